@@ -1,99 +1,92 @@
-import os
+import os, sys
 import numpy as np
 import argparse
 import json
-import bisect
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from preprocess.gps_priors import write_gps_table
 
-def find_neighbors(t, time_list):
-    # Assuming time_list is already sorted in ascending order
-    # Find the largest time smaller than t
-    left_index = bisect.bisect_left(time_list, t)  # Find the position of the first element >= t
-    max_time_before_t = time_list[left_index - 1] if left_index > 0 else None  # Get the largest time smaller than t
-
-    # Find the smallest time larger than t
-    right_index = bisect.bisect_right(time_list, t)  # Find the position of the first element > t
-    min_time_after_t = time_list[right_index] if right_index < len(time_list) else None  # Get the smallest time larger than t
-
-    return max_time_before_t, min_time_after_t
-
-# write a function using interpolation to get the gps info
-def interpolate_gps_info(t, t1, t2, gps_info1, gps_info2):
-    # t1 < t < t2
-    t_diff = t2 - t1
-    t1_diff = t - t1
-    t2_diff = t2 - t
-    # consider the gps info is [latitude, lat_ref, longitude, long_ref]
-    assert gps_info1[1] == gps_info2[1] and gps_info1[3] == gps_info2[3],\
-    'The reference is not the same.'
+def read_bus_gps(bus_signal_path):
+    # timestamps (sorted) and signed latitudes / longitudes of the bus signals
+    with open(bus_signal_path, 'r') as f:
+        bus_signal = json.load(f)
 
-    lat = (t2_diff * gps_info1[0] + t1_diff * gps_info2[0]) / t_diff
-    long = (t2_diff * gps_info1[2] + t1_diff * gps_info2[2]) / t_diff
-    return [lat, gps_info1[1], long, gps_info1[3]]
+    # values are [timestamp, value]
+    lat_degs = np.array(bus_signal['latitude_degree']['values'], np.float64).reshape(-1, 2)
+    lat_refs = np.array(bus_signal['latitude_direction']['values'], np.float64).reshape(-1, 2)
+    long_degs = np.array(bus_signal['longitude_degree']['values'], np.float64).reshape(-1, 2)
+    long_refs = np.array(bus_signal['longitude_direction']['values'], np.float64).reshape(-1, 2)
 
+    # evalute the length of gps is same.
+    assert len(lat_degs) == len(lat_refs) == len(long_degs) == len(long_refs),\
+    'The length of latitude and longitude is not the same.'
 
+    # direction 0 is N / E
+    tstamps = lat_degs[:, 0]
+    lats = np.where(lat_refs[:, 1] == 0, 1, -1) * lat_degs[:, 1]
+    longs = np.where(long_refs[:, 1] == 0, 1, -1) * long_degs[:, 1]
+
+    # sort by time, keeping the last value of repeated timestamps
+    order = np.argsort(tstamps, kind='stable')
+    tstamps, lats, longs = tstamps[order], lats[order], longs[order]
+    last = np.append(tstamps[1:] != tstamps[:-1], True)
+    return tstamps[last], lats[last], longs[last]
+
+def read_cam_tstamp(meta_path):
+    with open(meta_path, 'r') as f:
+        return json.load(f)['cam_tstamp']
+
+def interpolate_gps(tstamps, bus_tstamps, bus_lats, bus_longs):
+    # linear interpolation between the bus signals around each timestamp;
+    # timestamps outside of the signals are invalid
+    if len(bus_tstamps) == 0:
+        return np.zeros(len(tstamps)), np.zeros(len(tstamps)), np.zeros(len(tstamps), bool)
+    valid = (tstamps > bus_tstamps[0]) & (tstamps < bus_tstamps[-1])
+    return np.interp(tstamps, bus_tstamps, bus_lats), np.interp(tstamps, bus_tstamps, bus_longs), valid
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--images_meta_path', default='/home/yimingli/zhuoguang/datasets/a2d2_jpg/Munich/meta_infos')#required=True)
     parser.add_argument('--bus_signal_path', default='/home/yimingli/zhuoguang/datasets/a2d2_jpg/Munich/20190401121727_bus_signals.json')#required=True)
     parser.add_argument('--output_path', default='/home/yimingli/zhuoguang/datasets/a2d2_jpg/Munich/')#required=True)
+    parser.add_argument('--n_threads', default=16, type=int, help="Number of threads reading the image meta files")
+    parser.add_argument('--write_json', action='store_true', help="Also write the former {city}_imgs_gps.json file")
     args = parser.parse_args()
 
     city_name = args.images_meta_path.split('/')[-2]
 
-    bus_gps_infos = dict() # timestamp: [latitude, lat_ref, longitude, long_ref]
-    # open the bus signal json file
-    with open(args.bus_signal_path, 'r') as f:
-        bus_signal = json.load(f)
-
-        lat_degs = bus_signal['latitude_degree']['values']
-        lat_refs = bus_signal['latitude_direction']['values']
-        long_degs = bus_signal['longitude_degree']['values']
-        long_refs = bus_signal['longitude_direction']['values']
-
-    # evalute the length of gps is same.
-    assert len(lat_degs) == len(lat_refs) == len(long_degs) == len(long_refs),\
-    'The length of latitude and longitude is not the same.'
-    # assemble to bus_gps_infos
-    for idx, info in enumerate(lat_degs):
-        # info: [timestamp, value]
-        tstamp = info[0]
-        lat_deg = info[1]
-        lat_ref = 'N' if lat_refs[idx][1] == 0 else 'S'
-        long_deg = long_degs[idx][1]
-        long_ref = 'E' if long_refs[idx][1] == 0 else 'W'
-        bus_gps_infos[tstamp] = [lat_deg, lat_ref, long_deg, long_ref]
-
-    # get the time_list of bus_gps_infos
-    bus_time_list = list(bus_gps_infos.keys())
+    bus_tstamps, bus_lats, bus_longs = read_bus_gps(args.bus_signal_path)
 
     # open the image meta dir, and get the cam_dirs, don't contain files
     cam_dirs = [d for d in os.listdir(args.images_meta_path) if os.path.isdir(os.path.join(args.images_meta_path, d))]
-    img_gps_data = dict()
+    meta_paths = []
     for cam_dir in cam_dirs:
         # get the images meta files
         meta_files = [f for f in os.listdir(os.path.join(args.images_meta_path, cam_dir)) if f.endswith('.json')]
-        for meta_file in meta_files:
-            with open(os.path.join(args.images_meta_path, cam_dir, meta_file), 'r') as f:
-                meta_info = json.load(f)
-                # get the timestamp
-                tstamp = meta_info['cam_tstamp']
-            max_time_before_t, min_time_after_t = find_neighbors(tstamp, bus_time_list)
-            if max_time_before_t is None or min_time_after_t is None:
-                print(f'Cannot find the gps info for {meta_file}')
-                continue
-
-            img_gps = interpolate_gps_info(tstamp, max_time_before_t, min_time_after_t, bus_gps_infos[max_time_before_t], bus_gps_infos[min_time_after_t])
-            # extract the name of meta_file
-            img_name = os.path.splitext(meta_file)[0]
-            img_gps_data[img_name] = img_gps   
-
-    img_gps_infos = dict()
-    img_gps_infos['data_description'] = ['latitude_degree', 'latitude_reference', 'longitude_degree', 'longitude_reference'] 
-    img_gps_infos['data'] = img_gps_data  
-
-    # save the img_gps_data
-    with open(os.path.join(args.output_path, f'{city_name}_imgs_gps.json'), 'w') as f:
-        json.dump(img_gps_infos, f, indent=4)
-
-    print(0)
\ No newline at end of file
+        meta_paths += [os.path.join(args.images_meta_path, cam_dir, meta_file) for meta_file in meta_files]
+
+    with ThreadPoolExecutor(args.n_threads) as executor:
+        tstamps = np.array(list(executor.map(read_cam_tstamp, meta_paths)), np.float64)
+
+    lats, longs, valid = interpolate_gps(tstamps, bus_tstamps, bus_lats, bus_longs)
+    for idx in np.flatnonzero(~valid):
+        print(f'Cannot find the gps info for {os.path.basename(meta_paths[idx])}')
+
+    # the name of the meta file is the image key, the last file of a key wins
+    rows = {os.path.splitext(os.path.basename(meta_paths[idx]))[0]: idx for idx in np.flatnonzero(valid)}
+    keys = list(rows)
+    rows = np.array(list(rows.values()), np.int64)
+
+    write_gps_table(os.path.join(args.output_path, f'{city_name}_imgs_gps.npy'), keys, lats[rows], longs[rows])
+
+    if args.write_json:
+        img_gps_infos = dict()
+        img_gps_infos['data_description'] = ['latitude_degree', 'latitude_reference', 'longitude_degree', 'longitude_reference'] 
+        img_gps_infos['data'] = {
+            key: [abs(lat), 'N' if lat >= 0 else 'S', abs(long), 'E' if long >= 0 else 'W']
+            for key, lat, long in zip(keys, lats[rows].tolist(), longs[rows].tolist())
+        }
+        with open(os.path.join(args.output_path, f'{city_name}_imgs_gps.json'), 'w') as f:
+            json.dump(img_gps_infos, f, indent=4)
+
+    print(0)
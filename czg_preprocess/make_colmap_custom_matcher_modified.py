@@ -9,84 +9,13 @@
 # For inquiries contact  george.drettakis@inria.fr
 #
 
-import os
+import os, sys
 import numpy as np
-from joblib import delayed, Parallel
 import argparse
-import json
-from exif import Image
-from PIL import Image as PILImage
-from sklearn.neighbors import NearestNeighbors
-
-#TODO: clean it
-def decimal_coords(coords, ref):
-    decimal_degrees = coords[0] + coords[1] / 60 + coords[2] / 3600
-    if ref == "S" or ref =='W' :
-        decimal_degrees = -decimal_degrees
-    return decimal_degrees
-
-def coord_reverse(coord, ref):
-    if ref == "S" or ref == 'W':
-        coord = -coord
-    return coord
-
-# def image_coordinates(image_name):
-#     image_path = os.path.join(args.image_path, image_name)
-#     try:
-#         with open(image_path, 'rb') as src:
-#             pil_img = PILImage.open(src)
-#             if pil_img.format in ['JPEG', 'TIFF']:
-#                 img = Image(src)
-#                 if img.has_exif:
-#                     try:
-#                         img.gps_longitude
-#                         coords = [
-#                             decimal_coords(img.gps_latitude, img.gps_latitude_ref),
-#                             decimal_coords(img.gps_longitude, img.gps_longitude_ref)
-#                         ]
-#                         return coords
-#                     except AttributeError:
-#                         return None
-#     except Exception as e:
-#         print(f"Error processing {image_name}: {e}")
-#     return None
-
-def image_coordinates(image_name, use_gps, img_gps_path):
-    if use_gps:
-        if os.path.exists(img_gps_path):
-            with open(img_gps_path, 'r') as f:
-                img_gps_data = json.load(f)['data']
-
-            img_key = image_name.split('/')[-1].split('.')[0]
-            if img_key in img_gps_data:
-                coords = [
-                    coord_reverse(img_gps_data[img_key][0], img_gps_data[img_key][1]),
-                    coord_reverse(img_gps_data[img_key][2], img_gps_data[img_key][3])
-                ]
-                return coords
-    if image_name.split('.')[-1] not in ['jpg', 'JPG', 'jpeg', 'JPEG']:
-        return None
-    with open(os.path.join(args.image_path, image_name), 'rb') as src:
-        img = Image(src)
-    if img.has_exif:
-        try:
-            img.gps_longitude
-            coords = [
-                decimal_coords(img.gps_latitude, img.gps_latitude_ref),
-                decimal_coords(img.gps_longitude, img.gps_longitude_ref)
-            ]
-            return coords
-        except AttributeError:
-            return None
-    else:
-        return None    
-    
-def get_matches(img_name, cam_center, cam_nbrs, img_names_gps):
-    _, indices = cam_nbrs.kneighbors(cam_center[None])
-    matches = ""
-    for idx in indices[0, 1:]:
-        matches += f"{img_name} {img_names_gps[idx]}\n" 
-    return matches
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from preprocess.gps_priors import EXIF_GPS_INDEX_NAME, GPSPriors, geodetic_to_enu
+from preprocess.image_retrieval import compute_descriptors, iter_retrieval_pairs
+from preprocess.match_pairs import camera_offsets, frame_steps, read_rig_overlaps, filter_rig_pairs, pair_scores, iter_sequential_pairs, iter_loop_closure_pairs, iter_knn_pairs, iter_radius_pairs, PairWriter
 
 def find_images_names(root_dir):
     image_files_by_subdir = []
@@ -111,12 +40,20 @@ if __name__ == '__main__':
     parser.add_argument('--image_path', required=True)
     parser.add_argument('--output_path', required=True)
     parser.add_argument('--use_gps', action='store_true')
-    parser.add_argument('--img_gps_path', default='/home/yimingli/zhuoguang/datasets/a2d2_jpg/Gaimersheim/Gaimersheim_imgs_gps.json')
+    parser.add_argument('--img_gps_path', default='/home/yimingli/zhuoguang/datasets/a2d2_jpg/Gaimersheim/Gaimersheim_imgs_gps.npy', help="{city}_imgs_gps.npy table written by generate_imgs_gps.py, the {city}_imgs_gps.json next to it is read if it is missing")
     parser.add_argument('--n_seq_matches_per_view', default=0, type=int)
     parser.add_argument('--n_quad_matches_per_view', default=10, type=int)
     parser.add_argument('--n_loop_closure_match_per_view', default=5, type=int)
     parser.add_argument('--loop_matches', default=[], type=int) 
+    parser.add_argument('--rig_config', default=None, help="JSON file listing the camera folders that share field of view, see match_pairs.read_rig_overlaps. Other folders are not matched together")
     parser.add_argument('--n_gps_neighbours', default=25, type=int)
+    parser.add_argument('--gps_radius', default=0, type=float, help="Only match GPS neighbours closer than this, in meters. With --n_gps_neighbours 0, match all the images within this radius")
+    parser.add_argument('--n_retrieval_neighbours', default=0, type=int, help="Match each image with its most similar images, found with global descriptors, to close loops without GPS nor vocabulary tree. 0 disables it")
+    parser.add_argument('--retrieval_min_frame_gap', default=20, type=int, help="Images of the same camera closer than this many frames are not retrieved, they are already matched sequentially")
+    parser.add_argument('--n_workers', default=None, type=int, help="Processes computing the global descriptors")
+    parser.add_argument('--max_pairs_per_image', default=0, type=int, help="Only keep the best matches of each image, ranked by frame gap (shifted by the rig frame offsets) and GPS distance. Explicit loop closures rank first and a spanning tree of the matches is always kept. 0 disables it")
+    parser.add_argument('--max_total_pairs', default=0, type=int, help="Only keep the best matches overall, ranked the same way. 0 disables it")
+    parser.add_argument('--memory_budget', default=1024, type=int, help="Memory used to sort and deduplicate the matches, in MB. Larger match lists are merged on disk")
     args = parser.parse_args()
 
 
@@ -127,78 +64,57 @@ if __name__ == '__main__':
     loop_rel_matches = np.concatenate([-loop_rel_matches[::-1], np.array([0]), loop_rel_matches]) # [..., -4, -2, -1, 0, 1, 2, 4, ...]
 
     image_files_organised = find_images_names(args.image_path)
+    all_img_names = [os.path.join(cam['dir'], img_name) for cam in image_files_organised for img_name in cam['images']]
+    offsets = camera_offsets(image_files_organised)
+    rig = read_rig_overlaps(args.rig_config, [cam['dir'] for cam in image_files_organised]) if args.rig_config else None
+
+    use_gps_neighbours = args.n_gps_neighbours > 0 or args.gps_radius > 0
+    gps_centers = None
+    if use_gps_neighbours:
+        # the EXIF cache goes next to the matches, not in the image folder
+        exif_index_path = os.path.join(os.path.dirname(os.path.abspath(args.output_path)), EXIF_GPS_INDEX_NAME)
+        gps_priors = GPSPriors(args.image_path, args.img_gps_path if args.use_gps else None, exif_index_path=exif_index_path)
+        all_coords, has_gps = gps_priors.coordinates(all_img_names)
+        gps_idx = np.flatnonzero(has_gps)
+        # metric frame, distances in degrees depend on the latitude
+        gps_centers = np.full((len(all_img_names), 3), np.nan)
+        gps_centers[has_gps] = cam_centers = geodetic_to_enu(all_coords[has_gps])
 
-    cam_folder_list = []
-    cam_folder_list = os.listdir(f"{args.image_path}")
-
-
-    matches_str = []
-    def add_match(cam_id, matched_cam_id, current_image_file, matched_frame_id):
-        # REMOVE AFTER
-        # if (cam_folder_list[cam_id + matched_cam_id] == "backleft") and (not cam_folder_list[cam_id] == "backleft") and (matched_frame_id >= 785):
-        #     matched_frame_id -= 647
-        # if (not cam_folder_list[cam_id + matched_cam_id] == "backleft") and (cam_folder_list[cam_id] == "backleft") and (matched_frame_id >= 785):
-        #     matched_frame_id += 647
-
-        if matched_frame_id < len(matched_cam['images']):
-            matched_image_file = matched_cam['images'][matched_frame_id]
-            matches_str.append(f"{cam_folder_list[cam_id]}/{current_image_file} {cam_folder_list[cam_id + matched_cam_id]}/{matched_image_file}\n")
-
-
-    for cam_id, current_cam in enumerate(image_files_organised):
-        for matched_cam_id, matched_cam in enumerate(image_files_organised[cam_id:]):
-            for current_image_id, current_image_file in enumerate(current_cam['images']):
-                for frame_step in range(args.n_seq_matches_per_view): # 0
-                    matched_frame_id = current_image_id + frame_step
-                    add_match(cam_id, matched_cam_id, current_image_file, matched_frame_id)
-
-                for match_id in range(args.n_quad_matches_per_view):
-                    frame_step = args.n_seq_matches_per_view + int(2**match_id) - 1
-                    matched_frame_id = current_image_id + frame_step
-                    add_match(cam_id, matched_cam_id, current_image_file, matched_frame_id)
+    # with open(f"{args.image_path}/TEST_new_{args.n_seq_matches_per_view}_{args.n_quad_matches_per_view}_{args.n_loop_closure_match_per_view}_{args.n_gps_neighbours}.txt", "w") as f:
+    # the writer removes duplicate matches
+    pairs = PairWriter(
+        args.output_path, all_img_names, args.memory_budget * 2**20,
+        max_pairs_per_image=args.max_pairs_per_image, max_total_pairs=args.max_total_pairs,
+        scorer=lambda candidates: pair_scores(candidates, offsets, rig, gps_centers)
+    )
 
-            ## Loop closure
-            for loop_match in loop_matches: # assume loop_match = [1, 100]
-                for current_loop_rel_match in loop_rel_matches:
-                    current_image_id = (loop_match[0] + current_loop_rel_match) 
-                    if current_image_id < len(current_cam['images']):
-                        current_image_file = current_cam['images'][current_image_id]
-                        for matched_loop_rel_match in loop_rel_matches:
-                            matched_frame_id = (loop_match[1] + matched_loop_rel_match)
-                            add_match(cam_id, matched_cam_id, current_image_file, matched_frame_id)
+    for block in iter_sequential_pairs(offsets, frame_steps(args.n_seq_matches_per_view, args.n_quad_matches_per_view), rig):
+        pairs.add(block)
 
+    ## Loop closure
+    for block in iter_loop_closure_pairs(offsets, loop_matches, loop_rel_matches, rig):
+        pairs.add(block, np.zeros(len(block)))
 
     ## Add GPS matches
-    if args.n_gps_neighbours > 0:
-        all_img_names = []
-        for ind, cam in enumerate(image_files_organised):
-            all_img_names += [os.path.join(cam['dir'], img_name) for img_name in cam['images']]
-
-        all_cam_centers = [image_coordinates(img_name, args.use_gps, args.img_gps_path) for img_name in all_img_names]
-        # all_cam_centers = Parallel(n_jobs=-1, backend="threading")(
-        #     delayed(image_coordinates)(img_name) for img_name in all_img_names
-        # )
-        img_names_gps = [img_name for img_name, cam_center in zip(all_img_names, all_cam_centers) if cam_center is not None]
-        cam_centers_gps =  [cam_center for cam_center in all_cam_centers if cam_center is not None]
-        cam_centers = np.array(cam_centers_gps)
-        cam_nbrs = NearestNeighbors(n_neighbors=args.n_gps_neighbours).fit(cam_centers) if cam_centers.size else []
-
-        gps_matches = [get_matches(img_name, cam_center, cam_nbrs, img_names_gps) for img_name, cam_center in zip(img_names_gps, cam_centers)]
-        matches_str += gps_matches
-        # matches_str += [get_matches(img_name, cam_center, cam_nbrs, img_names_gps) for img_name, cam_center in zip(img_names_gps, cam_centers)]
-
-
-    ## Remove duplicate matches
-    intermediate_out_matches = list(dict.fromkeys(matches_str))
-    reciproc_matches = [f"{match.split(' ')[1][:-1]} {match.split(' ')[0]}\n" for match in intermediate_out_matches]
-    reciproc_matches_dict = dict.fromkeys(reciproc_matches)
-    out_matches = [
-        match for match in intermediate_out_matches
-        if not match in reciproc_matches_dict
-        ]
-
-    # with open(f"{args.image_path}/TEST_new_{args.n_seq_matches_per_view}_{args.n_quad_matches_per_view}_{args.n_loop_closure_match_per_view}_{args.n_gps_neighbours}.txt", "w") as f:
-    with open(args.output_path, "w") as f:
-        f.write(''.join(out_matches))
+    if use_gps_neighbours:
+        if args.n_gps_neighbours > 0:
+            gps_pairs = iter_knn_pairs(cam_centers, args.n_gps_neighbours, gps_idx, max_distance=args.gps_radius if args.gps_radius > 0 else np.inf)
+        else:
+            gps_pairs = iter_radius_pairs(cam_centers, args.gps_radius, gps_idx)
+        for block in gps_pairs:
+            pairs.add(block if rig is None else filter_rig_pairs(block, offsets, rig))
+
+    ## Add visually similar images
+    if args.n_retrieval_neighbours > 0:
+        descriptors = compute_descriptors([os.path.join(args.image_path, name) for name in all_img_names], args.n_workers)
+        for block in iter_retrieval_pairs(descriptors, args.n_retrieval_neighbours, offsets, args.retrieval_min_frame_gap):
+            pairs.add(block if rig is None else filter_rig_pairs(block, offsets, rig))
+
+    pairs.close()
+    if pairs.pruning:
+        print(f"{pairs.n_dropped} matches dropped by the pair budget")
+        if 0 < args.max_total_pairs < pairs.n_pairs:
+            print(f"{pairs.n_pairs} matches are needed to keep the images connected, above --max_total_pairs")
+    print(f"{pairs.n_pairs} matches written to {args.output_path}")
 
     print(0)
\ No newline at end of file
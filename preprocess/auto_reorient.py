@@ -12,6 +12,7 @@
 import numpy as np
 import argparse
 from read_write_model import *
+from pose_utils import image_poses, camera_centers, transform_poses
 import torch
 import argparse
 import os, time
@@ -40,38 +41,6 @@ def fit_plane_least_squares(points):
     
     return normal_vector, in_plane_vector, np.mean(points, axis=0)
 
-def rotate_camera(qvec, tvec, rot_matrix, upscale):
-    # Assuming cameras have 'T' (translation) field
-
-    R = qvec2rotmat(qvec)
-    T = np.array(tvec)
-
-    Rt = np.zeros((4, 4))
-    Rt[:3, :3] = R
-    Rt[:3, 3] = T
-    Rt[3, 3] = 1.0
-
-    C2W = np.linalg.inv(Rt)
-    cam_center = np.copy(C2W[:3, 3])
-    cam_rot_orig = np.copy(C2W[:3, :3])
-    cam_center = np.matmul(cam_center, rot_matrix)
-    cam_rot = np.linalg.inv(rot_matrix) @ cam_rot_orig
-    C2W[:3, 3] = upscale * cam_center
-    C2W[:3, :3] = cam_rot
-    Rt = np.linalg.inv(C2W)
-    new_pos = Rt[:3, 3]
-    new_rot = rotmat2qvec(Rt[:3, :3])
-
-    # R_test = qvec2rotmat(new_rots[-1])
-    # T_test = np.array(new_poss[-1])
-    # Rttest = np.zeros((4, 4))
-    # Rttest[:3, :3] = R_test
-    # Rttest[:3, 3] = T_test
-    # Rttest[3, 3] = 1.0
-    # C2Wtest = np.linalg.inv(Rttest) 
-
-    return new_pos, new_rot
-
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='Automatically reorient colmap')
@@ -88,32 +57,33 @@ if __name__ == '__main__':
 
     # Read colmap cameras, images and points
     start_time = time.time()
-    cameras, images_metas_in, points3d_in = read_model(args.input_path, ext=f".{args.model_type}")
+    cameras, images_metas_in, points3d_in = read_model(args.input_path, ext=f".{args.model_type}", points_as_table=True)
     end_time = time.time()
     print(f"{len(images_metas_in)} images read in {end_time - start_time} seconds.")
 
+    qvecs, tvecs = image_poses(images_metas_in)
+
     if args.upscale != 0:
         upscale = args.upscale
         print("manual upscale")
     else:    
         # compute upscale factor
-        median_distances = []
-        for key in images_metas_in:
-            image_meta = images_metas_in[key]
-            cam_center = -qvec2rotmat(image_meta.qvec).astype(np.float32).T @ image_meta.tvec.astype(np.float32)
-            
-            median_distances.extend([
-                np.linalg.norm(points3d_in[pt_idx].xyz - cam_center) for pt_idx in image_meta.point3D_ids if pt_idx != -1
-            ])
-
-        median_distance = np.median(np.array(median_distances))
+        cam_centers = camera_centers(qvecs, tvecs, dtype=np.float32)
+        point_rows = np.zeros(points3d_in.ids.max() + 1, np.int64)
+        point_rows[points3d_in.ids] = np.arange(points3d_in.num_points)
+
+        obs_point3D_ids = np.concatenate([images_metas_in[key].point3D_ids for key in images_metas_in]).astype(np.int64)
+        obs_cam_idx = np.repeat(np.arange(len(images_metas_in)), [len(images_metas_in[key].point3D_ids) for key in images_metas_in])
+        valid = obs_point3D_ids != -1
+
+        median_distances = np.linalg.norm(
+            points3d_in.xyz[point_rows[obs_point3D_ids[valid]]] - cam_centers[obs_cam_idx[valid]], axis=-1
+        )
+        median_distance = np.median(median_distances)
         upscale = (args.target_med_dist / median_distance)
 
 
-    cam_centers = np.array([
-        -qvec2rotmat(images_metas_in[key].qvec).T @ images_metas_in[key].tvec
-        for key in images_metas_in
-    ])
+    cam_centers = camera_centers(qvecs, tvecs)
 
     up, _, _ = fit_plane_least_squares(cam_centers)
 
@@ -141,36 +111,19 @@ if __name__ == '__main__':
     rotation_matrix = torch.stack([right, forward, up], dim=1)
 
 
-    positions = []
+    rotation_matrix = rotation_matrix.double().numpy()
+
     print("Doing points")
-    for key in points3d_in: 
-        positions.append(points3d_in[key].xyz)
-    
-    positions = torch.from_numpy(np.array(positions))
-    
     # Perform the rotation by matrix multiplication
-    rotated_points = upscale * torch.matmul(positions, rotation_matrix)
-
-
-
-    points3d_out = {}
-    for key, rotated in zip(points3d_in, rotated_points):
-        point3d_in = points3d_in[key]
-        points3d_out[key] = Point3D(
-            id=point3d_in.id,
-            xyz=rotated,
-            rgb=point3d_in.rgb,
-            error=point3d_in.error,
-            image_ids=point3d_in.image_ids,
-            point2D_idxs=point3d_in.point2D_idxs,
-        )
+    rotated_points = upscale * (points3d_in.xyz @ rotation_matrix)
+    points3d_out = points3d_in._replace(xyz=rotated_points)
 
     print("Doing images")
+    # points are transformed by x' = upscale * rotation_matrix.T @ x
+    new_rots, new_poss = transform_poses(qvecs, tvecs, upscale, rotation_matrix.T)
     images_metas_out = {} 
-    for key in images_metas_in: 
+    for key, new_rot, new_pos in zip(images_metas_in, new_rots, new_poss): 
         image_meta_in = images_metas_in[key]
-        new_pos, new_rot = rotate_camera(image_meta_in.qvec, image_meta_in.tvec, rotation_matrix.double().numpy(), upscale)
-        
         images_metas_out[key] = Image(
             id=image_meta_in.id,
             qvec=new_rot,
@@ -0,0 +1,46 @@
+import argparse
+import time
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+from match_pairs import iter_knn_pairs
+
+def make_random_trajectory(n_cameras, seed=0):
+    """Camera centers along a random walk, like a driving sequence."""
+    rng = np.random.default_rng(seed)
+    return np.cumsum(rng.normal(size=(n_cameras, 3)) * [1, 1, 0.05], axis=0).astype(np.float32)
+
+def timed(func):
+    start_time = time.time()
+    result = func()
+    return result, time.time() - start_time
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare per-image and batched nearest neighbour queries used to build the distance and GPS match lists.")
+    parser.add_argument('--n_cameras', default=[10000, 100000, 1000000], nargs='+', type=int)
+    parser.add_argument('--n_neighbours', default=100, type=int)
+    parser.add_argument('--n_reference_queries', default=1000, type=int, help="Number of per-image queries timed to extrapolate the per-image loop")
+    parser.add_argument('--max_sklearn_batch', default=100000, type=int, help="Skip the batched sklearn query above this number of cameras, its (N, k) output does not fit in memory")
+    args = parser.parse_args()
+
+    for n_cameras in args.n_cameras:
+        cam_centers = make_random_trajectory(n_cameras)
+        print(f"{n_cameras} cameras, {args.n_neighbours} neighbours")
+
+        cam_nbrs, fit_time = timed(lambda: NearestNeighbors(n_neighbors=args.n_neighbours).fit(cam_centers))
+        n_queries = min(args.n_reference_queries, n_cameras)
+        _, loop_time = timed(lambda: [cam_nbrs.kneighbors(cam_center[None]) for cam_center in cam_centers[:n_queries]])
+        print(f"{'per-image kneighbors (extrapolated)':<40} {fit_time + loop_time * n_cameras / n_queries:8.3f} s")
+
+        if n_cameras <= args.max_sklearn_batch:
+            _, batch_time = timed(lambda: cam_nbrs.kneighbors(cam_centers, return_distance=False))
+            print(f"{'batched kneighbors':<40} {fit_time + batch_time:8.3f} s")
+
+        pairs, tree_time = timed(lambda: np.concatenate(list(iter_knn_pairs(cam_centers, args.n_neighbours))))
+        print(f"{'iter_knn_pairs (cKDTree)':<40} {tree_time:8.3f} s")
+
+        # the neighbours of the first images must be the same as sklearn's
+        reference = cam_nbrs.kneighbors(cam_centers[:n_queries], return_distance=False)[:, 1:]
+        assert np.array_equal(
+            np.sort(pairs[:n_queries * (args.n_neighbours - 1), 1].reshape(n_queries, -1), axis=-1),
+            np.sort(reference, axis=-1)
+        ), "iter_knn_pairs differs from NearestNeighbors"
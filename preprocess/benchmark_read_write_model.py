@@ -0,0 +1,113 @@
+import os
+import argparse
+import filecmp
+import tempfile
+import time
+import numpy as np
+from read_write_model import *
+
+def write_images_binary_reference(images, path_to_model_file):
+    """Per-element writer the bulk write_images_binary replaces."""
+    with open(path_to_model_file, "wb") as fid:
+        write_next_bytes(fid, len(images), "Q")
+        for _, img in images.items():
+            write_next_bytes(fid, img.id, "i")
+            write_next_bytes(fid, img.qvec.tolist(), "dddd")
+            write_next_bytes(fid, img.tvec.tolist(), "ddd")
+            write_next_bytes(fid, img.camera_id, "i")
+            for char in img.name:
+                write_next_bytes(fid, char.encode("utf-8"), "c")
+            write_next_bytes(fid, b"\x00", "c")
+            write_next_bytes(fid, len(img.point3D_ids), "Q")
+            for xy, p3d_id in zip(img.xys, img.point3D_ids):
+                write_next_bytes(fid, [*xy, p3d_id], "ddq")
+
+def write_points3D_binary_reference(points3D, path_to_model_file):
+    """Per-element writer the bulk write_points3D_binary replaces."""
+    with open(path_to_model_file, "wb") as fid:
+        write_next_bytes(fid, len(points3D), "Q")
+        for _, pt in points3D.items():
+            write_next_bytes(fid, pt.id, "Q")
+            write_next_bytes(fid, pt.xyz.tolist(), "ddd")
+            write_next_bytes(fid, pt.rgb.tolist(), "BBB")
+            write_next_bytes(fid, pt.error, "d")
+            track_length = pt.image_ids.shape[0]
+            write_next_bytes(fid, track_length, "Q")
+            for image_id, point2D_id in zip(pt.image_ids, pt.point2D_idxs):
+                write_next_bytes(fid, [image_id, point2D_id], "ii")
+
+def make_random_model(n_images, n_points, mean_track_length, seed=0):
+    rng = np.random.default_rng(seed)
+    track_lengths = rng.poisson(mean_track_length, n_points)
+    track_offsets = np.zeros(n_points + 1, np.int64)
+    np.cumsum(track_lengths, out=track_offsets[1:])
+    n_obs = track_offsets[-1]
+    points3D = PointCloudTable(
+        ids=np.arange(1, n_points + 1, dtype=np.int64),
+        xyz=rng.normal(size=(n_points, 3)) * 100,
+        rgb=rng.integers(0, 256, (n_points, 3), dtype=np.uint8),
+        error=rng.random(n_points),
+        track_offsets=track_offsets,
+        track_image_ids=rng.integers(1, n_images + 1, n_obs, dtype=np.int32),
+        track_point2D_idxs=rng.integers(0, 10000, n_obs, dtype=np.int32),
+    )
+
+    # each observation of the tracks is a 2D point of an image
+    obs_image_ids = np.sort(points3D.track_image_ids)
+    obs_offsets = np.searchsorted(obs_image_ids, np.arange(1, n_images + 2))
+    obs_point3D_ids = rng.integers(-1, n_points + 1, n_obs)
+    obs_xys = rng.random((n_obs, 2)) * 2000
+    images = {}
+    for image_id in range(1, n_images + 1):
+        qvec = rng.normal(size=4)
+        start, end = obs_offsets[image_id - 1], obs_offsets[image_id]
+        images[image_id] = Image(
+            id=image_id,
+            qvec=qvec / np.linalg.norm(qvec),
+            tvec=rng.normal(size=3),
+            camera_id=1,
+            name=f"cam_{image_id % 6}/{image_id:08d}.jpg",
+            xys=obs_xys[start:end],
+            point3D_ids=obs_point3D_ids[start:end],
+        )
+    return images, points3D
+
+def bench(name, func, path, n_bytes=None):
+    start_time = time.time()
+    result = func()
+    elapsed = time.time() - start_time
+    n_bytes = os.path.getsize(path) if n_bytes is None else n_bytes
+    print(f"{name:<40} {elapsed:8.3f} s {n_bytes / elapsed / 2**20:10.1f} MB/s")
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check that the bulk COLMAP writers are byte-identical to the per-element ones and measure their throughput.")
+    parser.add_argument('--n_images', default=20000, type=int)
+    parser.add_argument('--n_points', default=2000000, type=int)
+    parser.add_argument('--mean_track_length', default=5, type=float)
+    parser.add_argument('--skip_reference', action="store_true", default=False, help="Only time the bulk reader/writers")
+    args = parser.parse_args()
+
+    print(f"generating {args.n_images} images, {args.n_points} points...")
+    images, points3D_table = make_random_model(args.n_images, args.n_points, args.mean_track_length)
+    points3D = points3D_table.to_points3D()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        images_file = os.path.join(tmp_dir, "images.bin")
+        points3D_file = os.path.join(tmp_dir, "points3D.bin")
+        bench("write_images_binary", lambda: write_images_binary(images, images_file), images_file)
+        bench("write_points3D_binary", lambda: write_points3D_binary(points3D, points3D_file), points3D_file)
+        bench("write_points3D_binary_table", lambda: write_points3D_binary_table(points3D_table, points3D_file), points3D_file)
+        bench("read_images_binary", lambda: read_images_binary(images_file), images_file)
+        bench("read_points3D_binary_table", lambda: read_points3D_binary_table(points3D_file), points3D_file)
+
+        if not args.skip_reference:
+            images_ref_file = os.path.join(tmp_dir, "images_ref.bin")
+            points3D_ref_file = os.path.join(tmp_dir, "points3D_ref.bin")
+            bench("write_images_binary (reference)", lambda: write_images_binary_reference(images, images_ref_file), images_ref_file)
+            bench("write_points3D_binary (reference)", lambda: write_points3D_binary_reference(points3D, points3D_ref_file), points3D_ref_file)
+            bench("read_points3D_binary", lambda: read_points3D_binary(points3D_ref_file), points3D_ref_file)
+
+            assert filecmp.cmp(images_file, images_ref_file, shallow=False), "images.bin differs from reference"
+            assert filecmp.cmp(points3D_file, points3D_ref_file, shallow=False), "points3D.bin differs from reference"
+            print("bulk writers are byte-identical to the reference writers")
@@ -30,13 +30,13 @@
 
 # This script is based on an original implementation by True Price.
 
-import sys
 import sqlite3
+from contextlib import contextmanager
 import numpy as np
+from scipy.sparse import csr_matrix
+from read_write_model import qvec2rotmat
 
 
-IS_PYTHON3 = sys.version_info[0] >= 3
-
 MAX_IMAGE_ID = 2 ** 31 - 1
 
 CREATE_CAMERAS_TABLE = """CREATE TABLE IF NOT EXISTS cameras (
@@ -124,22 +124,63 @@ def image_ids_to_pair_id(image_id1, image_id2):
 
 def pair_id_to_image_ids(pair_id):
     image_id2 = pair_id % MAX_IMAGE_ID
-    image_id1 = (pair_id - image_id2) / MAX_IMAGE_ID
+    image_id1 = (pair_id - image_id2) // MAX_IMAGE_ID
     return image_id1, image_id2
 
 
+def image_ids_to_pair_ids(image_ids1, image_ids2):
+    """image_ids_to_pair_id over arrays of image ids, as int64."""
+    image_ids1 = np.asarray(image_ids1, np.int64)
+    image_ids2 = np.asarray(image_ids2, np.int64)
+    return (
+        np.minimum(image_ids1, image_ids2) * MAX_IMAGE_ID
+        + np.maximum(image_ids1, image_ids2)
+    )
+
+
+def pair_ids_to_image_ids(pair_ids):
+    """pair_id_to_image_ids over an array of pair ids, as int64."""
+    pair_ids = np.asarray(pair_ids, np.int64)
+    return pair_ids // MAX_IMAGE_ID, pair_ids % MAX_IMAGE_ID
+
+
 def array_to_blob(array):
-    if IS_PYTHON3:
-        return array.tostring()
-    else:
-        return np.getbuffer(array)
+    """Buffer over the bytes of the array, sqlite3 stores it as a BLOB
+    without an intermediate bytes copy (the array is only copied if it is
+    not C-contiguous)."""
+    return memoryview(np.ascontiguousarray(array).reshape(-1).view(np.uint8))
 
 
 def blob_to_array(blob, dtype, shape=(-1,)):
-    if IS_PYTHON3:
-        return np.fromstring(blob, dtype=dtype).reshape(*shape)
-    else:
-        return np.frombuffer(blob, dtype=dtype).reshape(*shape)
+    """Read-only array viewing the blob, without copy."""
+    if blob is None:
+        blob = b""
+    return np.frombuffer(blob, dtype=dtype).reshape(*shape)
+
+
+def keypoints_row(image_id, keypoints):
+    assert len(keypoints.shape) == 2
+    assert keypoints.shape[1] in [2, 4, 6]
+
+    keypoints = np.asarray(keypoints, np.float32)
+    return (image_id,) + keypoints.shape + (array_to_blob(keypoints),)
+
+
+def descriptors_row(image_id, descriptors):
+    descriptors = np.ascontiguousarray(descriptors, np.uint8)
+    return (image_id,) + descriptors.shape + (array_to_blob(descriptors),)
+
+
+def matches_row(image_id1, image_id2, matches):
+    assert len(matches.shape) == 2
+    assert matches.shape[1] == 2
+
+    if image_id1 > image_id2:
+        matches = matches[:, ::-1]
+
+    pair_id = image_ids_to_pair_id(image_id1, image_id2)
+    matches = np.asarray(matches, np.uint32)
+    return (pair_id,) + matches.shape + (array_to_blob(matches),)
 
 
 class COLMAPDatabase(sqlite3.Connection):
@@ -198,8 +239,8 @@ class COLMAPDatabase(sqlite3.Connection):
         self,
         name,
         camera_id,
-        prior_q=np.full(4, np.NaN),
-        prior_t=np.full(3, np.NaN),
+        prior_q=np.full(4, np.nan),
+        prior_t=np.full(3, np.nan),
         image_id=None,
     ):
         cursor = self.execute(
@@ -220,36 +261,183 @@ class COLMAPDatabase(sqlite3.Connection):
         return cursor.lastrowid
 
     def add_keypoints(self, image_id, keypoints):
-        assert len(keypoints.shape) == 2
-        assert keypoints.shape[1] in [2, 4, 6]
-
-        keypoints = np.asarray(keypoints, np.float32)
         self.execute(
             "INSERT INTO keypoints VALUES (?, ?, ?, ?)",
-            (image_id,) + keypoints.shape + (array_to_blob(keypoints),),
+            keypoints_row(image_id, keypoints),
         )
 
     def add_descriptors(self, image_id, descriptors):
-        descriptors = np.ascontiguousarray(descriptors, np.uint8)
         self.execute(
             "INSERT INTO descriptors VALUES (?, ?, ?, ?)",
-            (image_id,) + descriptors.shape + (array_to_blob(descriptors),),
+            descriptors_row(image_id, descriptors),
         )
 
     def add_matches(self, image_id1, image_id2, matches):
-        assert len(matches.shape) == 2
-        assert matches.shape[1] == 2
+        self.execute(
+            "INSERT INTO matches VALUES (?, ?, ?, ?)",
+            matches_row(image_id1, image_id2, matches),
+        )
 
-        if image_id1 > image_id2:
-            matches = matches[:, ::-1]
+    def add_images_bulk(
+        self, names, camera_ids, image_ids=None, prior_qs=None, prior_ts=None
+    ):
+        """Insert all the images with one executemany, in one transaction.
+
+        prior_qs (N, 4) and prior_ts (N, 3) default to NaN, image_ids to
+        new ids.
+        """
+        n_images = len(names)
+        if image_ids is None:
+            image_ids = [None] * n_images
+        else:
+            image_ids = np.asarray(image_ids, np.int64).tolist()
+        if prior_qs is None:
+            prior_qs = np.full((n_images, 4), np.nan)
+        if prior_ts is None:
+            prior_ts = np.full((n_images, 3), np.nan)
+        priors = np.concatenate(
+            [
+                np.asarray(prior_qs, np.float64).reshape(n_images, 4),
+                np.asarray(prior_ts, np.float64).reshape(n_images, 3),
+            ],
+            axis=1,
+        ).tolist()
+        self.executemany(
+            "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (image_id, name, camera_id, *prior)
+                for image_id, name, camera_id, prior in zip(
+                    image_ids,
+                    names,
+                    np.asarray(camera_ids, np.int64).tolist(),
+                    priors,
+                )
+            ),
+        )
 
-        pair_id = image_ids_to_pair_id(image_id1, image_id2)
-        matches = np.asarray(matches, np.uint32)
-        self.execute(
+    def add_keypoints_bulk(self, keypoints):
+        """Insert (image_id, keypoints) items with one executemany, in one
+        transaction. keypoints can be a generator, it is consumed lazily."""
+        self.executemany(
+            "INSERT INTO keypoints VALUES (?, ?, ?, ?)",
+            (keypoints_row(*item) for item in keypoints),
+        )
+
+    def add_descriptors_bulk(self, descriptors):
+        """Insert (image_id, descriptors) items, like add_keypoints_bulk."""
+        self.executemany(
+            "INSERT INTO descriptors VALUES (?, ?, ?, ?)",
+            (descriptors_row(*item) for item in descriptors),
+        )
+
+    def add_matches_bulk(self, matches):
+        """Insert (image_id1, image_id2, matches) items, like
+        add_keypoints_bulk."""
+        self.executemany(
             "INSERT INTO matches VALUES (?, ?, ?, ?)",
-            (pair_id,) + matches.shape + (array_to_blob(matches),),
+            (matches_row(*item) for item in matches),
+        )
+
+    def iter_arrays(self, query, dtype, batch_size=1024):
+        """Yield lists of at most batch_size (key, array) from a query
+        selecting (key, rows, cols, data); only one batch of blobs is held
+        in memory. The arrays are read-only views of the blobs."""
+        cursor = self.execute(query)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [
+                (key, blob_to_array(data, dtype, (n_rows, n_cols)))
+                for key, n_rows, n_cols, data in rows
+            ]
+
+    def iter_keypoints(self, batch_size=1024):
+        """Batches of (image_id, (N, 2|4|6) float32 keypoints)."""
+        return self.iter_arrays(
+            "SELECT image_id, rows, cols, data FROM keypoints",
+            np.float32,
+            batch_size,
+        )
+
+    def iter_descriptors(self, batch_size=1024):
+        """Batches of (image_id, (N, 128) uint8 descriptors)."""
+        return self.iter_arrays(
+            "SELECT image_id, rows, cols, data FROM descriptors",
+            np.uint8,
+            batch_size,
+        )
+
+    def iter_matches(self, batch_size=1024, verified=False):
+        """Batches of (pair_id, (N, 2) uint32 matches), of the inlier
+        matches of two_view_geometries if verified."""
+        table = "two_view_geometries" if verified else "matches"
+        return self.iter_arrays(
+            f"SELECT pair_id, rows, cols, data FROM {table}",
+            np.uint32,
+            batch_size,
+        )
+
+    def two_view_geometry_graph(self, min_num_inliers=1):
+        """Matching graph of the images as a symmetric CSR matrix indexed
+        by image id: entry (i, j) is the number of inlier matches between
+        images i and j, for the pairs with at least min_num_inliers.
+
+        The pairs are read with a single query, without their blobs.
+        """
+        pairs = np.fromiter(
+            self.execute(
+                "SELECT pair_id, rows FROM two_view_geometries "
+                "WHERE rows >= ?",
+                (min_num_inliers,),
+            ),
+            dtype=[("pair_id", np.int64), ("num_inliers", np.int64)],
+        )
+        image_ids1, image_ids2 = pair_ids_to_image_ids(pairs["pair_id"])
+        max_image_id = self.execute("SELECT MAX(image_id) FROM images")
+        n_images = max(
+            max_image_id.fetchone()[0] or 0,
+            image_ids2.max(initial=0),
+        )
+        return csr_matrix(
+            (
+                np.tile(pairs["num_inliers"], 2),
+                (
+                    np.concatenate([image_ids1, image_ids2]),
+                    np.concatenate([image_ids2, image_ids1]),
+                ),
+            ),
+            shape=(n_images + 1, n_images + 1),
         )
 
+    @contextmanager
+    def bulk_load(self, cache_size_mb=1024):
+        """Session for ingesting many rows: WAL journal, no fsync and a
+        large page cache. The session is committed (or rolled back on error)
+        and the previous settings are restored when it ends.
+
+        A crash during the session can corrupt the database, only use it on
+        databases that can be rebuilt.
+        """
+        self.commit()
+        journal_mode = self.execute("PRAGMA journal_mode").fetchone()[0]
+        synchronous = self.execute("PRAGMA synchronous").fetchone()[0]
+        cache_size = self.execute("PRAGMA cache_size").fetchone()[0]
+        self.execute("PRAGMA journal_mode=WAL")
+        self.execute("PRAGMA synchronous=OFF")
+        # negative sizes are in KiB
+        self.execute(f"PRAGMA cache_size={-cache_size_mb * 1024}")
+        try:
+            yield self
+            self.commit()
+        except BaseException:
+            self.rollback()
+            raise
+        finally:
+            self.execute(f"PRAGMA journal_mode={journal_mode}")
+            self.execute(f"PRAGMA synchronous={synchronous}")
+            self.execute(f"PRAGMA cache_size={cache_size}")
+
     def add_two_view_geometry(
         self,
         image_id1,
@@ -290,6 +478,177 @@ class COLMAPDatabase(sqlite3.Connection):
             ),
         )
 
+    def copy_images_from(self, src_path, image_names, matches=False):
+        """Copy images with their keypoints and descriptors from the
+        database at src_path, and with matches=True the matches and
+        two-view geometries between them.
+
+        Images are identified by name. The images already in this database
+        keep their id and camera; the others are added with their cameras
+        under new ids. Pair ids are remapped to the ids of this database.
+
+        Raises ValueError, without modifying this database, if an image is
+        missing from the source database or if its source camera differs
+        from its camera here (its keypoints would not fit). Returns the
+        number of images copied.
+        """
+        self.commit()
+        self.execute("ATTACH DATABASE ? AS src", (src_path,))
+        try:
+            n_images = self._copy_attached_images(image_names, matches)
+            self.commit()
+        except BaseException:
+            self.rollback()
+            raise
+        finally:
+            self.execute("DROP TABLE IF EXISTS temp.subset_names")
+            self.execute("DROP TABLE IF EXISTS temp.image_map")
+            self.execute("DETACH DATABASE src")
+        return n_images
+
+    def _copy_attached_images(self, image_names, matches):
+        self.execute("CREATE TEMP TABLE subset_names (name TEXT PRIMARY KEY)")
+        self.executemany(
+            "INSERT OR IGNORE INTO subset_names VALUES (?)",
+            ((name,) for name in image_names),
+        )
+        missing = self.execute(
+            """SELECT w.name FROM subset_names w
+            LEFT JOIN src.images s ON s.name = w.name
+            WHERE s.image_id IS NULL"""
+        ).fetchall()
+        if missing:
+            raise ValueError(
+                f"{len(missing)} images are not in the source database, "
+                f"e.g. {missing[0][0]}"
+            )
+
+        # the keypoints of the images already here must fit their camera
+        for row in self.execute(
+            """SELECT s.name, sc.model, sc.width, sc.height, sc.params,
+                dc.model, dc.width, dc.height, dc.params
+            FROM subset_names w
+            JOIN src.images s ON s.name = w.name
+            JOIN main.images d ON d.name = w.name
+            JOIN src.cameras sc ON sc.camera_id = s.camera_id
+            JOIN main.cameras dc ON dc.camera_id = d.camera_id
+            GROUP BY s.camera_id, d.camera_id"""
+        ):
+            name, src_camera, dst_camera = row[0], row[1:5], row[5:]
+            if src_camera[:3] != dst_camera[:3] or not np.allclose(
+                blob_to_array(src_camera[3], np.float64),
+                blob_to_array(dst_camera[3], np.float64),
+            ):
+                raise ValueError(
+                    f"the camera of {name} differs from the source database"
+                )
+
+        # add the other images, with copies of their cameras
+        new_images = self.execute(
+            """SELECT s.image_id, s.camera_id FROM subset_names w
+            JOIN src.images s ON s.name = w.name
+            LEFT JOIN main.images d ON d.name = w.name
+            WHERE d.image_id IS NULL"""
+        ).fetchall()
+        camera_ids = {}
+        for src_image_id, src_camera_id in new_images:
+            if src_camera_id not in camera_ids:
+                camera_ids[src_camera_id] = self.execute(
+                    """INSERT INTO cameras SELECT NULL, model, width, height,
+                        params, prior_focal_length
+                    FROM src.cameras WHERE camera_id = ?""",
+                    (src_camera_id,),
+                ).lastrowid
+        self.executemany(
+            """INSERT INTO images SELECT NULL, name, ?, prior_qw, prior_qx,
+                prior_qy, prior_qz, prior_tx, prior_ty, prior_tz
+            FROM src.images WHERE image_id = ?""",
+            (
+                (camera_ids[src_camera_id], src_image_id)
+                for src_image_id, src_camera_id in new_images
+            ),
+        )
+
+        self.execute(
+            """CREATE TEMP TABLE image_map AS
+            SELECT s.image_id AS src_id, d.image_id AS dst_id
+            FROM subset_names w
+            JOIN src.images s ON s.name = w.name
+            JOIN main.images d ON d.name = w.name"""
+        )
+        for table in ["keypoints", "descriptors"]:
+            self.execute(
+                f"""INSERT OR REPLACE INTO main.{table}
+                SELECT m.dst_id, t.rows, t.cols, t.data FROM src.{table} t
+                JOIN image_map m ON m.src_id = t.image_id"""
+            )
+        if matches:
+            self._copy_attached_pairs()
+        return self.execute("SELECT COUNT(*) FROM image_map").fetchone()[0]
+
+    def _copy_attached_pairs(self):
+        pairs_join = f"""JOIN image_map m1
+                ON m1.src_id = t.pair_id / {MAX_IMAGE_ID}
+            JOIN image_map m2 ON m2.src_id = t.pair_id % {MAX_IMAGE_ID}"""
+        new_pair_id = f"m1.dst_id * {MAX_IMAGE_ID} + m2.dst_id"
+        # pairs whose images keep their order are copied as they are
+        self.execute(
+            f"""INSERT OR REPLACE INTO main.matches
+            SELECT {new_pair_id}, t.rows, t.cols, t.data FROM src.matches t
+            {pairs_join} WHERE m1.dst_id < m2.dst_id"""
+        )
+        self.execute(
+            f"""INSERT OR REPLACE INTO main.two_view_geometries
+            SELECT {new_pair_id}, t.rows, t.cols, t.data, t.config,
+                t.F, t.E, t.H, t.qvec, t.tvec
+            FROM src.two_view_geometries t
+            {pairs_join} WHERE m1.dst_id < m2.dst_id"""
+        )
+
+        # the others are seen from the second image
+        for image_id1, image_id2, n_rows, n_cols, data in self.execute(
+            f"""SELECT m1.dst_id, m2.dst_id, t.rows, t.cols, t.data
+            FROM src.matches t {pairs_join}
+            WHERE m1.dst_id > m2.dst_id"""
+        ).fetchall():
+            self.execute(
+                "INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?)",
+                matches_row(
+                    image_id1,
+                    image_id2,
+                    blob_to_array(data, np.uint32, (n_rows, n_cols)),
+                ),
+            )
+        for row in self.execute(
+            f"""SELECT m1.dst_id, m2.dst_id, t.rows, t.cols, t.data,
+                t.config, t.F, t.E, t.H, t.qvec, t.tvec
+            FROM src.two_view_geometries t {pairs_join}
+            WHERE m1.dst_id > m2.dst_id"""
+        ).fetchall():
+            image_id1, image_id2, n_rows, n_cols, data, config = row[:6]
+            F, E, H = (
+                blob_to_array(blob, np.float64, (3, 3)) for blob in row[6:9]
+            )
+            qvec = blob_to_array(row[9], np.float64)
+            tvec = blob_to_array(row[10], np.float64)
+            # relative pose, homography and fundamental matrices of 2 to 1
+            R = qvec2rotmat(qvec)
+            self.execute(
+                "DELETE FROM two_view_geometries WHERE pair_id = ?",
+                (image_ids_to_pair_id(image_id1, image_id2),),
+            )
+            self.add_two_view_geometry(
+                image_id1,
+                image_id2,
+                blob_to_array(data, np.uint32, (n_rows, n_cols)),
+                F=F.T,
+                E=E.T,
+                H=np.linalg.inv(H) if np.linalg.det(H) != 0 else H,
+                qvec=qvec * [1, -1, -1, -1],
+                tvec=-R.T @ tvec,
+                config=config,
+            )
+
 
 def example_usage():
     import os
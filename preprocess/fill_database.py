@@ -1,6 +1,6 @@
 import argparse
 import database
-from read_write_model import read_model, CAMERA_MODEL_NAMES
+from read_write_model import read_cameras_binary, read_images_binary, CAMERA_MODEL_NAMES
 import os
 
 if __name__ == '__main__':
@@ -12,19 +12,22 @@ if __name__ == '__main__':
     if os.path.exists(args.database_path):
         os.remove(args.database_path)
         
-    cam_intrinsics, images_metas, _, = read_model(args.in_dir, ".bin")
+    cam_intrinsics = read_cameras_binary(os.path.join(args.in_dir, "cameras.bin"))
+    images_metas = read_images_binary(os.path.join(args.in_dir, "images.bin"), fields=("camera_id", "name"))
     db = database.COLMAPDatabase.connect(args.database_path)
     db.create_tables()
 
-    for key in cam_intrinsics:
-        cam = cam_intrinsics[key]
-        db.add_camera(CAMERA_MODEL_NAMES[cam.model].model_id, cam.width, cam.height, cam.params, camera_id=key)
+    with db.bulk_load():
+        for key in cam_intrinsics:
+            cam = cam_intrinsics[key]
+            db.add_camera(CAMERA_MODEL_NAMES[cam.model].model_id, cam.width, cam.height, cam.params, camera_id=key)
 
-    for key in images_metas:
-        image_meta = images_metas[key]
-        db.add_image(image_meta.name, image_meta.camera_id, image_id=key)
-
-    db.commit()
+        db.add_images_bulk(
+            [image_meta.name for image_meta in images_metas.values()],
+            [image_meta.camera_id for image_meta in images_metas.values()],
+            image_ids=list(images_metas)
+        )
+    db.close()
     # shutil.copy(f"{args.in_dir}/cameras.txt", f"{args.out_dir}/cameras.txt")
 
     print(0)
\ No newline at end of file
@@ -9,10 +9,11 @@
 # For inquiries contact  george.drettakis@inria.fr
 #
 
-import os, sys, shutil
+import os, shutil
 import subprocess
 import argparse
 from read_write_model import read_images_binary,write_images_binary, Image
+from pipeline_stages import StageRunner
 import time, platform
 
 def replace_images_by_masks(images_file, out_file):
@@ -57,6 +58,7 @@ if __name__ == '__main__':
     parser.add_argument('--project_dir', type=str, required=True)
     parser.add_argument('--images_dir', default="", help="Will be set to project_dir/inputs/images if not set")
     parser.add_argument('--masks_dir', default="", help="Will be set to project_dir/inputs/masks if exists and not set")
+    parser.add_argument('--rerun_from', default=None, choices=["feature_extractor", "custom_matcher", "matches_importer", "hierarchical_mapper", "simplify_images", "image_undistorter", "mask_undistorter", "auto_reorient"], help="Run this stage and the following ones even if they are up to date")
     args = parser.parse_args()
     
     if args.images_dir == "":
@@ -72,140 +74,121 @@ if __name__ == '__main__':
 
     setup_dirs(args.project_dir)
 
+    # completed stages are skipped when the script is run again
+    stages = StageRunner(f"{args.project_dir}/camera_calibration/stages", args.rerun_from)
+    unrectified_dir = f"{args.project_dir}/camera_calibration/unrectified"
+    rectified_dir = f"{args.project_dir}/camera_calibration/rectified"
+
     ## Feature extraction, matching then mapper to generate the colmap.
     print("extracting features ...")
     colmap_feature_extractor_args = [
         colmap_exe, "feature_extractor",
-        "--database_path", f"{args.project_dir}/camera_calibration/unrectified/database.db",
+        "--database_path", f"{unrectified_dir}/database.db",
         "--image_path", f"{args.images_dir}",
         "--ImageReader.single_camera", "1",
         "--ImageReader.default_focal_length_factor", "0.5",
         "--ImageReader.camera_model", "OPENCV",
         ]
-    
-    try:
-        subprocess.run(colmap_feature_extractor_args, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing colmap feature_extractor: {e}")
-        sys.exit(1)
+    stages.run("feature_extractor", colmap_feature_extractor_args,
+        inputs=[args.images_dir], outputs=[f"{unrectified_dir}/database.db"])
 
     print("making custom matches...")
     make_colmap_custom_matcher_args = [
         "python", f"preprocess/make_colmap_custom_matcher.py",
         "--image_path", f"{args.images_dir}",
-        "--output_path", f"{args.project_dir}/camera_calibration/unrectified/matching.txt"
+        "--output_path", f"{unrectified_dir}/matching.txt"
     ]
-    try:
-        subprocess.run(make_colmap_custom_matcher_args, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing make_colmap_custom_matcher: {e}")
-        sys.exit(1)
+    stages.run("custom_matcher", make_colmap_custom_matcher_args,
+        inputs=[args.images_dir], outputs=[f"{unrectified_dir}/matching.txt"])
 
     ## Feature matching
     print("matching features...")
     colmap_matches_importer_args = [
         colmap_exe, "matches_importer",
-        "--database_path", f"{args.project_dir}/camera_calibration/unrectified/database.db",
-        "--match_list_path", f"{args.project_dir}/camera_calibration/unrectified/matching.txt"
+        "--database_path", f"{unrectified_dir}/database.db",
+        "--match_list_path", f"{unrectified_dir}/matching.txt"
         ]
-    try:
-        subprocess.run(colmap_matches_importer_args, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing colmap matches_importer: {e}")
-        sys.exit(1)
+    stages.run("matches_importer", colmap_matches_importer_args,
+        inputs=[f"{unrectified_dir}/database.db", f"{unrectified_dir}/matching.txt"], outputs=[f"{unrectified_dir}/database.db"])
 
     ## Generate sfm pointcloud
     print("generating sfm point cloud...")
     colmap_hierarchical_mapper_args = [
         colmap_exe, "hierarchical_mapper",
-        "--database_path", f"{args.project_dir}/camera_calibration/unrectified/database.db",
+        "--database_path", f"{unrectified_dir}/database.db",
         "--image_path", f"{args.images_dir}",
-        "--output_path", f"{args.project_dir}/camera_calibration/unrectified/sparse",
+        "--output_path", f"{unrectified_dir}/sparse",
         "--Mapper.ba_global_function_tolerance", "0.000001" 
         ]
-    try:
-        subprocess.run(colmap_hierarchical_mapper_args, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing colmap hierarchical_mapper: {e}")
-        sys.exit(1)
+    stages.run("hierarchical_mapper", colmap_hierarchical_mapper_args,
+        inputs=[f"{unrectified_dir}/database.db", args.images_dir], outputs=[f"{unrectified_dir}/sparse/0/images.bin"])
 
     ## Simplify images so that everything takes less time (reading colmap usually takes forever)
     simplify_images_args = [
         "python", f"preprocess/simplify_images.py",
-        "--base_dir", f"{args.project_dir}/camera_calibration/unrectified/sparse/0"
+        "--base_dir", f"{unrectified_dir}/sparse/0"
     ]
-    try:
-        subprocess.run(simplify_images_args, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing simplify_images: {e}")
-        sys.exit(1)
+    stages.run("simplify_images", simplify_images_args,
+        inputs=[f"{unrectified_dir}/sparse/0/images.bin"], outputs=[f"{unrectified_dir}/sparse/0/images_heavy.bin"])
 
     ## Undistort images
-    print(f"undistorting images from {args.images_dir} to {args.project_dir}/camera_calibration/rectified images...")
+    print(f"undistorting images from {args.images_dir} to {rectified_dir} images...")
     colmap_image_undistorter_args = [
         colmap_exe, "image_undistorter",
         "--image_path", f"{args.images_dir}",
-        "--input_path", f"{args.project_dir}/camera_calibration/unrectified/sparse/0", 
-        "--output_path", f"{args.project_dir}/camera_calibration/rectified/",
+        "--input_path", f"{unrectified_dir}/sparse/0", 
+        "--output_path", f"{rectified_dir}/",
         "--output_type", "COLMAP",
         "--max_image_size", "2048",
         ]
-    try:
-        subprocess.run(colmap_image_undistorter_args, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing image_undistorter: {e}")
-        sys.exit(1)
+    stages.run("image_undistorter", colmap_image_undistorter_args,
+        inputs=[args.images_dir, f"{unrectified_dir}/sparse/0/images.bin", f"{unrectified_dir}/sparse/0/cameras.bin"],
+        outputs=[f"{rectified_dir}/sparse", f"{rectified_dir}/images"])
 
     if not args.masks_dir == "":
-        # create a copy of colmap as txt and replace jpgs with pngs to undistort masks the same way images were distorted
-        if not os.path.exists(f"{args.project_dir}/camera_calibration/unrectified/sparse/0/masks"):
-            os.makedirs(f"{args.project_dir}/camera_calibration/unrectified/sparse/0/masks")
-
-        shutil.copy(f"{args.project_dir}/camera_calibration/unrectified/sparse/0/cameras.bin", f"{args.project_dir}/camera_calibration/unrectified/sparse/0/masks/cameras.bin")
-        shutil.copy(f"{args.project_dir}/camera_calibration/unrectified/sparse/0/points3D.bin", f"{args.project_dir}/camera_calibration/unrectified/sparse/0/masks/points3D.bin")
-        replace_images_by_masks(f"{args.project_dir}/camera_calibration/unrectified/sparse/0/images.bin", f"{args.project_dir}/camera_calibration/unrectified/sparse/0/masks/images.bin")
-
-        print("undistorting masks aswell...")
-        colmap_image_undistorter_args = [
-            colmap_exe, "image_undistorter",
-            "--image_path", f"{args.masks_dir}",
-            "--input_path", f"{args.project_dir}/camera_calibration/unrectified/sparse/0/masks", 
-            "--output_path", f"{args.project_dir}/camera_calibration/tmp/",
-            "--output_type", "COLMAP",
-            "--max_image_size", "2048",
-            ]
-        try:
+        def undistort_masks():
+            # create a copy of colmap as txt and replace jpgs with pngs to undistort masks the same way images were distorted
+            if not os.path.exists(f"{unrectified_dir}/sparse/0/masks"):
+                os.makedirs(f"{unrectified_dir}/sparse/0/masks")
+
+            shutil.copy(f"{unrectified_dir}/sparse/0/cameras.bin", f"{unrectified_dir}/sparse/0/masks/cameras.bin")
+            shutil.copy(f"{unrectified_dir}/sparse/0/points3D.bin", f"{unrectified_dir}/sparse/0/masks/points3D.bin")
+            replace_images_by_masks(f"{unrectified_dir}/sparse/0/images.bin", f"{unrectified_dir}/sparse/0/masks/images.bin")
+
+            print("undistorting masks aswell...")
+            colmap_image_undistorter_args = [
+                colmap_exe, "image_undistorter",
+                "--image_path", f"{args.masks_dir}",
+                "--input_path", f"{unrectified_dir}/sparse/0/masks", 
+                "--output_path", f"{args.project_dir}/camera_calibration/tmp/",
+                "--output_type", "COLMAP",
+                "--max_image_size", "2048",
+                ]
             subprocess.run(colmap_image_undistorter_args, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"Error executing image_undistorter: {e}")
-            sys.exit(1)
-        
-        make_mask_uint8_args = [
-            "python", f"preprocess/make_mask_uint8.py",
-            "--in_dir", f"{args.project_dir}/camera_calibration/tmp/images",
-            "--out_dir", f"{args.project_dir}/camera_calibration/rectified/masks"
-        ]
-        try:
+
+            make_mask_uint8_args = [
+                "python", f"preprocess/make_mask_uint8.py",
+                "--in_dir", f"{args.project_dir}/camera_calibration/tmp/images",
+                "--out_dir", f"{rectified_dir}/masks"
+            ]
             subprocess.run(make_mask_uint8_args, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"Error executing make_colmap_custom_matcher: {e}")
-            sys.exit(1)
 
-        # remove temporary dir containing undistorted masks
-        shutil.rmtree(f"{args.project_dir}/camera_calibration/tmp")
+            # remove temporary dir containing undistorted masks
+            shutil.rmtree(f"{args.project_dir}/camera_calibration/tmp")
+
+        stages.run("mask_undistorter", undistort_masks, params=[args.masks_dir],
+            inputs=[args.masks_dir, f"{unrectified_dir}/sparse/0/images.bin", f"{unrectified_dir}/sparse/0/cameras.bin"],
+            outputs=[f"{rectified_dir}/masks"])
 
     # re-orient + scale colmap
     print(f"re-orient and scaling scene to {args.project_dir}/camera_calibration/aligned/sparse/0")
     reorient_args = [
             "python", f"preprocess/auto_reorient.py",
-            "--input_path", f"{args.project_dir}/camera_calibration/rectified/sparse",
+            "--input_path", f"{rectified_dir}/sparse",
             "--output_path", f"{args.project_dir}/camera_calibration/aligned/sparse/0"
         ]
-    try:
-        subprocess.run(reorient_args, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing auto_orient: {e}")
-        sys.exit(1)
+    stages.run("auto_reorient", reorient_args,
+        inputs=[f"{rectified_dir}/sparse"], outputs=[f"{args.project_dir}/camera_calibration/aligned/sparse/0/images.bin"])
 
     end_time = time.time()
     print(f"Preprocessing done in {(end_time - start_time)/60.0} minutes.")
\ No newline at end of file
@@ -0,0 +1,289 @@
+#
+# Copyright (C) 2024, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+"""GPS priors (latitude, longitude in degrees, altitude in meters) of the
+images, used to add GPS neighbours to the custom match lists."""
+
+import os
+import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+EXIF_GPS_INDEX_NAME = "exif_gps_index.npz"
+EXIF_GPS_INDEX_VERSION = 1
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+# TIFF tags and types used to find the GPS position
+GPS_IFD_TAG = 0x8825
+GPS_LATITUDE_REF, GPS_LATITUDE, GPS_LONGITUDE_REF, GPS_LONGITUDE = 1, 2, 3, 4
+GPS_ALTITUDE_REF, GPS_ALTITUDE = 5, 6
+TIFF_BYTE, TIFF_ASCII, TIFF_RATIONAL, TIFF_SRATIONAL = 1, 2, 5, 10
+
+
+def decimal_coords(coords, ref):
+    decimal_degrees = coords[0] + coords[1] / 60 + coords[2] / 3600
+    if ref == "S" or ref =='W' :
+        decimal_degrees = -decimal_degrees
+    return decimal_degrees
+
+
+def coord_reverse(coord, ref):
+    if ref == "S" or ref == 'W':
+        coord = -coord
+    return coord
+
+
+def geodetic_to_enu(coords, origin=None):
+    """Local East-North-Up coordinates in meters of (N, 3) [lat, lon, alt].
+
+    The origin [lat, lon, alt] defaults to the mean position of the images.
+    The altitudes are only used if all the images have one, otherwise the
+    points are put on the ellipsoid.
+    """
+    coords = np.array(coords, np.float64).reshape(-1, 3)
+    if np.isnan(coords[:, 2]).any():
+        coords[:, 2] = 0
+    if origin is None:
+        origin = coords.mean(axis=0) if len(coords) > 0 else np.zeros(3)
+
+    def to_ecef(lat, lon, alt):
+        lat, lon = np.radians(lat), np.radians(lon)
+        N = WGS84_A / np.sqrt(1 - WGS84_E2 * np.sin(lat)**2)
+        return np.stack([
+            (N + alt) * np.cos(lat) * np.cos(lon),
+            (N + alt) * np.cos(lat) * np.sin(lon),
+            (N * (1 - WGS84_E2) + alt) * np.sin(lat)
+        ], axis=-1)
+
+    lat0, lon0 = np.radians(origin[0]), np.radians(origin[1])
+    ecef_to_enu = np.array([
+        [-np.sin(lon0), np.cos(lon0), 0],
+        [-np.sin(lat0) * np.cos(lon0), -np.sin(lat0) * np.sin(lon0), np.cos(lat0)],
+        [np.cos(lat0) * np.cos(lon0), np.cos(lat0) * np.sin(lon0), np.sin(lat0)]
+    ])
+    return (to_ecef(*coords.T) - to_ecef(*origin)) @ ecef_to_enu.T
+
+
+def read_app1_exif(f):
+    """TIFF data of the Exif APP1 segment of a JPEG file, or None.
+
+    Only the marker segments before the image data are read, not the whole
+    file.
+    """
+    if f.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        header = f.read(4)
+        if len(header) < 4 or header[0] != 0xff:
+            return None
+        marker, length = header[1], struct.unpack(">H", header[2:])[0]
+        # start of scan: the metadata segments are over
+        if marker == 0xda:
+            return None
+        if marker == 0xe1:
+            segment = f.read(length - 2)
+            if segment[:6] == b"Exif\x00\x00":
+                return segment[6:]
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_ifd(tiff, offset, endian):
+    """{tag: (type, count, value or offset bytes)} of the IFD at offset."""
+    n_entries = struct.unpack_from(endian + "H", tiff, offset)[0]
+    entries = {}
+    for entry in range(n_entries):
+        tag, tiff_type, count = struct.unpack_from(endian + "HHI", tiff, offset + 2 + 12 * entry)
+        entries[tag] = (tiff_type, count, tiff[offset + 10 + 12 * entry:offset + 14 + 12 * entry])
+    return entries
+
+
+def ifd_value(tiff, entry, endian):
+    tiff_type, count, value = entry
+    if tiff_type == TIFF_BYTE:
+        return value[0]
+    if tiff_type == TIFF_ASCII:
+        data = value if count <= 4 else tiff[struct.unpack(endian + "I", value)[0]:][:count]
+        return data.split(b"\x00")[0].decode("ascii")
+    if tiff_type in (TIFF_RATIONAL, TIFF_SRATIONAL):
+        offset = struct.unpack(endian + "I", value)[0]
+        numbers = struct.unpack_from(endian + ("I" if tiff_type == TIFF_RATIONAL else "i") * 2 * count, tiff, offset)
+        return tuple(num / den for num, den in zip(numbers[::2], numbers[1::2]))
+    raise ValueError(f"unexpected TIFF type {tiff_type}")
+
+
+def exif_coordinates(image_path):
+    """[latitude, longitude, altitude] from the EXIF of a JPEG, or None. The
+    altitude is NaN when the GPS IFD does not have one."""
+    if image_path.split('.')[-1] not in ['jpg', 'JPG', 'jpeg', 'JPEG']:
+        return None
+    with open(image_path, 'rb') as src:
+        tiff = read_app1_exif(src)
+    if tiff is None:
+        return None
+    try:
+        endian = {b"II": "<", b"MM": ">"}[tiff[:2]]
+        ifd0 = read_ifd(tiff, struct.unpack_from(endian + "I", tiff, 4)[0], endian)
+        if GPS_IFD_TAG not in ifd0:
+            return None
+        gps_ifd = read_ifd(tiff, struct.unpack(endian + "I", ifd0[GPS_IFD_TAG][2])[0], endian)
+        altitude = np.nan
+        if GPS_ALTITUDE in gps_ifd:
+            altitude = ifd_value(tiff, gps_ifd[GPS_ALTITUDE], endian)[0]
+            # altitude reference 1: below sea level
+            if GPS_ALTITUDE_REF in gps_ifd and ifd_value(tiff, gps_ifd[GPS_ALTITUDE_REF], endian) == 1:
+                altitude = -altitude
+        return [
+            decimal_coords(ifd_value(tiff, gps_ifd[GPS_LATITUDE], endian), ifd_value(tiff, gps_ifd[GPS_LATITUDE_REF], endian)),
+            decimal_coords(ifd_value(tiff, gps_ifd[GPS_LONGITUDE], endian), ifd_value(tiff, gps_ifd[GPS_LONGITUDE_REF], endian)),
+            altitude
+        ]
+    except (KeyError, IndexError, ValueError, ZeroDivisionError, struct.error):
+        return None
+
+
+def read_exif_coordinates(image_path, image_names, n_threads=16, index_path=None):
+    """(N, 3) EXIF coordinates of the images, NaN when unknown, read in a
+    thread pool.
+
+    With an index_path, the EXIF is only read for the images whose size or
+    mtime differ from the index there, which is then rewritten. The index is
+    never written by default: the image folder is an input of other tools.
+    """
+    paths = [os.path.join(image_path, name) for name in image_names]
+    stats = np.full((len(paths), 2), -1, np.int64)
+    for idx, path in enumerate(paths):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            stats[idx] = stat.st_size, stat.st_mtime_ns
+
+    coords = np.full((len(paths), 3), np.nan)
+    todo = stats[:, 0] >= 0
+    index = None
+    if index_path is not None and os.path.exists(index_path):
+        index = dict(np.load(index_path))
+        if index.get("version") != EXIF_GPS_INDEX_VERSION:
+            index = None
+    if index is not None:
+        rows = {name: row for row, name in enumerate(index["names"])}
+        for idx, name in enumerate(image_names):
+            row = rows.get(name)
+            if todo[idx] and row is not None and np.array_equal(index["stats"][row], stats[idx]):
+                coords[idx] = index["coords"][row]
+                todo[idx] = False
+
+    todo = np.flatnonzero(todo)
+    if len(todo) > 0:
+        print(f"reading the EXIF GPS of {len(todo)} images")
+        with ThreadPoolExecutor(n_threads) as executor:
+            for idx, image_coords in zip(todo, executor.map(exif_coordinates, [paths[idx] for idx in todo])):
+                if image_coords is not None:
+                    coords[idx] = image_coords
+
+    if len(todo) > 0 and index_path is not None:
+        # keep the entries of the other images of the index
+        names, index_stats, index_coords = np.array(image_names, dtype=str), stats, coords
+        if index is not None:
+            kept = ~np.isin(index["names"], names)
+            names = np.concatenate([index["names"][kept], names])
+            index_stats = np.concatenate([index["stats"][kept], stats])
+            index_coords = np.concatenate([index["coords"][kept], coords])
+
+        # write to a temporary file first so other runs never see a partial index
+        tmp_path = index_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, version=EXIF_GPS_INDEX_VERSION, names=names, stats=index_stats, coords=index_coords)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"Could not write EXIF GPS index {index_path}: {e}")
+    return coords
+
+
+def gps_table_dtype(key_length):
+    return np.dtype([("key", f"<U{max(key_length, 1)}"), ("latitude", "<f8"), ("longitude", "<f8")])
+
+
+def write_gps_table(path, keys, latitudes, longitudes):
+    """Write the signed coordinates of the images as a structured .npy
+    array, sorted by key, that read_gps_table can memory-map."""
+    table = np.empty(len(keys), gps_table_dtype(max(map(len, keys), default=1)))
+    table["key"], table["latitude"], table["longitude"] = keys, latitudes, longitudes
+    np.save(path, np.sort(table, order="key"))
+
+
+def read_gps_table(path):
+    """Keys and (N, 3) coordinates of a GPS table written by
+    generate_imgs_gps.py, either the .npy table or the older JSON file
+    whose entries are [lat, lat_ref, lon, lon_ref]. The tables have no
+    altitude."""
+    if path.endswith(".npy"):
+        table = np.load(path, mmap_mode="r")
+        coords = np.full((len(table), 3), np.nan)
+        coords[:, 0], coords[:, 1] = table["latitude"], table["longitude"]
+        return table["key"].tolist(), coords
+
+    with open(path, 'r') as f:
+        img_gps_data = json.load(f)['data']
+    keys = list(img_gps_data)
+    coords = np.array([
+        [coord_reverse(gps[0], gps[1]), coord_reverse(gps[2], gps[3]), np.nan]
+        for gps in img_gps_data.values()
+    ], np.float64).reshape(-1, 3)
+    return keys, coords
+
+
+class GPSPriors:
+    """Coordinates of the images of image_path.
+
+    The images are looked up by key (file name without directory nor
+    extension) in the GPS table if one is given, or in the JSON table of the
+    same name when a .npy table is missing. The table is loaded once.
+    The EXIF of the images missing from it is read by read_exif_coordinates,
+    cached in the index at exif_index_path if one is given.
+    """
+
+    def __init__(self, image_path, gps_table_path=None, n_threads=16, exif_index_path=None):
+        self.image_path = image_path
+        self.n_threads = n_threads
+        self.exif_index_path = exif_index_path
+        self.keys, self.coords = [], np.zeros((0, 3))
+        if gps_table_path is not None and not os.path.exists(gps_table_path):
+            # tables written before the .npy format only have the JSON file
+            json_path = os.path.splitext(gps_table_path)[0] + ".json"
+            if gps_table_path.endswith(".npy") and os.path.exists(json_path):
+                print(f"{gps_table_path} not found, reading {json_path}")
+                gps_table_path = json_path
+        if gps_table_path is not None and os.path.exists(gps_table_path):
+            self.keys, self.coords = read_gps_table(gps_table_path)
+        self.rows = {key: row for row, key in enumerate(self.keys)}
+
+    @staticmethod
+    def image_key(image_name):
+        return image_name.split('/')[-1].split('.')[0]
+
+    def coordinates(self, image_names):
+        """(N, 3) coordinates of the images, NaN when unknown, and the mask
+        of the images that have some."""
+        coords = np.full((len(image_names), 3), np.nan)
+        rows = np.array([self.rows.get(self.image_key(name), -1) for name in image_names], np.int64)
+        in_table = rows >= 0
+        coords[in_table] = self.coords[rows[in_table]]
+
+        missing = np.flatnonzero(~in_table)
+        if len(missing) > 0:
+            coords[missing] = read_exif_coordinates(self.image_path, [image_names[idx] for idx in missing], self.n_threads, self.exif_index_path)
+        return coords, ~np.isnan(coords[:, 0])
@@ -0,0 +1,110 @@
+#
+# Copyright (C) 2024, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+"""Visually similar image pairs from compact global descriptors, to find
+loop closures without a vocabulary tree nor exhaustive matching.
+
+The descriptor of an image is its normalized grayscale thumbnail together
+with a coarse grid of gradient orientation histograms, both computed on a
+reduced decode of the image. The descriptors of a capture are then PCA
+whitened and compared with the cosine similarity.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+
+THUMBNAIL_SIZE = 16
+HOG_CELLS = 4
+HOG_BINS = 8
+
+
+def global_descriptor(image_path):
+    """Descriptor of an image, or None if it cannot be read."""
+    image = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        return None
+    image = cv2.resize(image, (64, 64), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    thumbnail = cv2.resize(image, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA).ravel()
+    thumbnail -= thumbnail.mean()
+    thumbnail /= np.linalg.norm(thumbnail) + 1e-6
+
+    # gradient orientation histograms over a HOG_CELLS x HOG_CELLS grid
+    gx = cv2.Sobel(image, cv2.CV_32F, 1, 0)
+    gy = cv2.Sobel(image, cv2.CV_32F, 0, 1)
+    magnitude, angle = cv2.cartToPolar(gx, gy)
+    bins = np.minimum((angle % np.pi) / np.pi * HOG_BINS, HOG_BINS - 1).astype(np.int64)
+    cell_size = 64 // HOG_CELLS
+    cells = (np.arange(64) // cell_size)[:, None] * HOG_CELLS + (np.arange(64) // cell_size)[None, :]
+    hog = np.bincount((cells * HOG_BINS + bins).ravel(), weights=magnitude.ravel(), minlength=HOG_CELLS**2 * HOG_BINS)
+    hog = np.sqrt(hog)
+    hog /= np.linalg.norm(hog) + 1e-6
+
+    return np.concatenate([thumbnail, hog]).astype(np.float32)
+
+
+def compute_descriptors(image_paths, n_workers=None, n_dims=64):
+    """(N, n_dims) unit descriptors of the images, PCA whitened over the
+    images; rows of unreadable images are 0."""
+    with ProcessPoolExecutor(n_workers) as executor:
+        descriptors = list(executor.map(global_descriptor, image_paths, chunksize=64))
+    valid = np.array([descriptor is not None for descriptor in descriptors], bool)
+    n_features = THUMBNAIL_SIZE**2 + HOG_CELLS**2 * HOG_BINS
+    raw = np.zeros((len(image_paths), n_features), np.float32)
+    if valid.any():
+        raw[valid] = np.stack([descriptor for descriptor in descriptors if descriptor is not None])
+
+    out = np.zeros((len(image_paths), n_dims), np.float32)
+    if valid.sum() < 2:
+        return out
+    centered = raw[valid] - raw[valid].mean(axis=0)
+    _, singular_values, components = np.linalg.svd(centered, full_matrices=False)
+    n_dims = min(n_dims, len(components))
+    projected = centered @ components[:n_dims].T / (singular_values[:n_dims] + 1e-6)
+    projected /= np.linalg.norm(projected, axis=-1, keepdims=True) + 1e-6
+    out[valid, :n_dims] = projected
+    return out
+
+
+def iter_retrieval_pairs(descriptors, n_neighbours, offsets=None, min_frame_gap=0, memory_budget=1 << 28):
+    """Pairs of each image with its n_neighbours most similar images.
+
+    The similarities are computed exactly, by blocks of images whose
+    similarities and partition indices (12 bytes per pair of images) fit in
+    memory_budget bytes. Images of the same camera (given its offsets, see
+    match_pairs.camera_offsets) less than min_frame_gap frames apart are not
+    candidates: they are already matched sequentially.
+    """
+    descriptors = np.asarray(descriptors, np.float32)
+    n_images = len(descriptors)
+    n_neighbours = min(n_neighbours, n_images - 1)
+    if n_neighbours < 1:
+        return
+    if offsets is None:
+        offsets = np.array([0, n_images], np.int64)
+    invalid = np.flatnonzero(~np.any(descriptors != 0, axis=-1))
+    cam_ids = np.searchsorted(offsets, np.arange(n_images), side="right") - 1
+    # the image itself and its neighbouring frames, in its camera
+    window = np.arange(-max(min_frame_gap, 1) + 1, max(min_frame_gap, 1))
+    batch_size = max(memory_budget // (12 * n_images), 1)
+    for start in range(0, n_images, batch_size):
+        end = min(start + batch_size, n_images)
+        rows = np.arange(start, end)
+        similarities = descriptors[start:end] @ descriptors.T
+        similarities[:, invalid] = -np.inf
+        cols = rows[:, None] + window[None, :]
+        in_camera = (cols >= offsets[cam_ids[rows]][:, None]) & (cols < offsets[cam_ids[rows] + 1][:, None])
+        similarities[np.broadcast_to(rows[:, None] - start, cols.shape)[in_camera], cols[in_camera]] = -np.inf
+        neighbours = np.argpartition(similarities, n_images - n_neighbours, axis=-1)[:, n_images - n_neighbours:]
+        found = np.isfinite(np.take_along_axis(similarities, neighbours, axis=-1))
+        found[np.isin(rows, invalid)] = False
+        yield np.stack([np.broadcast_to(rows[:, None], neighbours.shape)[found], neighbours[found]], axis=-1)
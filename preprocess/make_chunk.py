@@ -12,34 +12,249 @@
 import numpy as np
 import argparse
 import cv2
-from joblib import delayed, Parallel
 import os
-import random
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
+from scipy import sparse
 from read_write_model import *
+from pose_utils import image_poses, camera_centers
 import json
 
-def get_nb_pts(image_metas):
-    n_pts = 0
-    for key in image_metas:
-        pts_idx = image_metas[key].point3D_ids
-        if(len(pts_idx) > 5):
-            n_pts = max(n_pts, np.max(pts_idx))
-
-    return n_pts + 1
+def grid_cells(points, x_edges, y_edges):
+    """Flat cell index (i * n_height + j) of each point in the chunk grid.
+
+    Uses the same strict bounds as the per-chunk masks: the outer rows and
+    columns of the grid extend to +-1e12 and points lying exactly on an
+    inner cell border belong to no cell (-1).
+    """
+    points = points.astype(np.float64).reshape(-1, 3)
+    n_height = len(y_edges) - 1
+    i = np.searchsorted(x_edges[1:-1], points[:, 0], side="right")
+    j = np.searchsorted(y_edges[1:-1], points[:, 1], side="right")
+    on_border = ((i > 0) & (points[:, 0] == x_edges[i])) | ((j > 0) & (points[:, 1] == y_edges[j]))
+    out_of_range = ~np.all(np.abs(points) < 1e12, axis=-1)
+    return np.where(on_border | out_of_range, -1, i * n_height + j)
+
+def sort_by_cell(cells, n_cells):
+    """Counting sort of the points by cell.
+
+    Returns the permutation that groups the points of each cell (keeping
+    their relative order) and the offsets of the cells in it: the points of
+    cell c are order[offsets[c]:offsets[c + 1]]. Points of cell -1 are
+    dropped.
+    """
+    valid = np.flatnonzero(cells >= 0)
+    offsets = np.zeros(n_cells + 1, np.int64)
+    np.cumsum(np.bincount(cells[valid], minlength=n_cells), out=offsets[1:])
+    order = valid[np.argsort(cells[valid], kind="stable")]
+    return order, offsets
+
+LAPLACIAN_INDEX_NAME = "laplacian_index.npz"
+IMREAD_REDUCED_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+def get_var_of_laplacian(path, reduction=1):
+    # the reduced decodes let libjpeg skip most of the IDCT work
+    image = cv2.imread(path, IMREAD_REDUCED_FLAGS[reduction])
+    if image is not None:
+        return cv2.Laplacian(image, cv2.CV_32F).var()
+    else:
+        return 0
+
+def read_laplacians(images_dir, names, index_path, reduction=1):
+    """Variance of the Laplacian of each image, as a sharpness measure.
+
+    Values of images whose size and mtime did not change are read from the
+    index at index_path; the others are computed in a process pool and the
+    index is rewritten. Missing images get 0.
+    """
+    paths = [os.path.join(images_dir, name) for name in names]
+    stats = np.full((len(paths), 2), -1, np.int64)
+    for idx, path in enumerate(paths):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            stats[idx] = stat.st_size, stat.st_mtime_ns
+
+    laplacians = np.zeros(len(paths), np.float64)
+    todo = stats[:, 0] >= 0
+    if os.path.exists(index_path):
+        index = np.load(index_path)
+        if index["reduction"] == reduction:
+            rows = {name: row for row, name in enumerate(index["names"])}
+            for idx, name in enumerate(names):
+                row = rows.get(name)
+                if todo[idx] and row is not None and np.array_equal(index["stats"][row], stats[idx]):
+                    laplacians[idx] = index["laplacians"][row]
+                    todo[idx] = False
+
+    n_missing = np.sum(stats[:, 0] < 0)
+    todo = np.flatnonzero(todo)
+    print(f"computing the laplacians of {len(todo)} images, {len(paths) - len(todo) - n_missing} read from {index_path}, {n_missing} missing")
+    if len(todo) > 0:
+        with ProcessPoolExecutor() as executor:
+            laplacians[todo] = list(executor.map(get_var_of_laplacian, [paths[idx] for idx in todo], repeat(reduction), chunksize=64))
+
+        # write to a temporary file first so other runs never see a partial index
+        tmp_path = index_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, reduction=reduction, names=np.array(names, dtype=str), stats=stats, laplacians=laplacians)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"Could not write laplacian index {index_path}: {e}")
+    return laplacians
+
+# shared read-only data of the cells, filled in the main process or in each worker
+chunk_data = {}
+
+def share_arrays(arrays):
+    """Copy arrays to shared memory blocks the worker processes can attach to."""
+    blocks, specs = [], {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+def init_worker(specs, settings):
+    blocks = []
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        chunk_data[name] = np.ndarray(shape, dtype, buffer=block.buf)
+    # keep the blocks attached for the lifetime of the worker
+    chunk_data["blocks"] = blocks
+    chunk_data.update(settings)
+
+def make_chunk(i, j):
+    """Write the cameras and points of cell (i, j).
+
+    Returns whether the chunk was excluded and the number of points of the
+    chunk seen by each test image it contains.
+    """
+    args, global_bbox = chunk_data["args"], chunk_data["global_bbox"]
+    n_height = chunk_data["n_height"]
+    xyzsC, colorsC, indicesC, errorsC = chunk_data["xyzsC"], chunk_data["colorsC"], chunk_data["indicesC"], chunk_data["errorsC"]
+    cam_centers, n_obs = chunk_data["cam_centers"], chunk_data["n_obs"]
+    n_images = len(cam_centers)
+
+    print(f"chunk {i}_{j}")
+    corner_min = global_bbox[0] + np.array([i * args.chunk_size, j * args.chunk_size, 0])
+    corner_max = global_bbox[0] + np.array([(i + 1) * args.chunk_size, (j + 1) * args.chunk_size, 1e12])
+    corner_min[2] = -1e12
+    corner_max[2] = 1e12
+    
+    # the points are sorted by cell, the chunk is a slice of them
+    cell = i * n_height + j
+    start, end = chunk_data["point_offsets"][cell], chunk_data["point_offsets"][cell + 1]
+    new_xyzs = xyzsC[start:end]
+    new_colors = colorsC[start:end]
+    new_indices = indicesC[start:end]
+    new_errors = errorsC[start:end]
+
+    new_colors = np.clip(new_colors, 0, 255).astype(np.uint8)
+
+    in_chunk = np.all(cam_centers < corner_max, axis=-1) * np.all(cam_centers > corner_min, axis=-1)
+
+    box_center = (corner_max + corner_min) / 2
+    extent = (corner_max - corner_min) / 2
+    acceptable_radius = 2
+    extended_corner_min = box_center - acceptable_radius * extent
+    extended_corner_max = box_center + acceptable_radius * extent
+    in_extended = np.all(cam_centers < extended_corner_max, axis=-1) * np.all(cam_centers > extended_corner_min, axis=-1)
+
+    # number of points of each image inside the chunk (column of the images x cells matrix)
+    start, end = chunk_data["counts_indptr"][cell], chunk_data["counts_indptr"][cell + 1]
+    n_pts = np.zeros(n_images, np.int64)
+    n_pts[chunk_data["counts_indices"][start:end]] = chunk_data["counts_data"][start:end]
+    # seeded by the cell so that the selection does not depend on the processing order
+    rng = np.random.default_rng([0, i, j])
+    extended_draws, far_draws = rng.random((2, n_images))
+
+    # If within chunk
+    valid_cam = in_chunk * (n_pts > 50)
+    # If within 2x of the chunk
+    valid_cam |= ~in_chunk * in_extended * (n_pts > 50) * (extended_draws > 0.5)
+    # All distances
+    if args.add_far_cams:
+        far_cam = ~valid_cam * (n_pts > 10)
+        valid_cam[far_cam] = 0.5 * far_draws[far_cam] < n_pts[far_cam] / n_obs[far_cam]
+
+    print(f"{valid_cam.sum()} valid cameras after visibility-base selection")
+    if args.lapla_thresh > 0:
+        laplacians = chunk_data["laplacians"]
+        chunk_laplacians = laplacians[valid_cam]
+        laplacian_mean = chunk_laplacians.mean()
+        laplacian_std_dev = chunk_laplacians.std()
+        valid_cam[laplacians < (laplacian_mean - args.lapla_thresh * laplacian_std_dev)] = False
+
+        print(f"{valid_cam.sum()} after Laplacian")
+
+    if valid_cam.sum() > args.max_n_cams:
+        remove_idx = rng.choice(np.flatnonzero(valid_cam), valid_cam.sum() - args.max_n_cams, replace=False)
+        valid_cam[remove_idx] = False
+
+        print(f"{valid_cam.sum()} after random removal")
+
+    chunk_blending = {}
+    if valid_cam.sum() > args.min_n_cams:# or init_valid_cam.sum() > 0:
+        out_path = os.path.join(args.output_path, f"{i}_{j}")
+        out_colmap = os.path.join(out_path, "sparse", "0")
+        os.makedirs(out_colmap, exist_ok=True)
+
+        # must remove sfm points to use colmap triangulator in following steps
+        images_out = {}
+        for idx in np.flatnonzero(valid_cam):
+            key, name = chunk_data["keys"][idx], chunk_data["names"][idx]
+            images_out[key] = Image(
+                id = key,
+                qvec = chunk_data["qvecs"][idx],
+                tvec = chunk_data["tvecs"][idx],
+                camera_id = chunk_data["camera_ids"][idx],
+                name = name,
+                xys = [],
+                point3D_ids = []
+            )
+
+            if name in chunk_data["test_point3D_ids"]:
+                n_pts = np.isin(chunk_data["test_point3D_ids"][name], new_indices).sum()
+                chunk_blending[name] = str(n_pts)
+
+
+        points_out = PointCloudTable.from_arrays(new_indices, new_xyzs, new_colors, new_errors)
+
+        write_model(chunk_data["cam_intrinsics"], images_out, points_out, out_colmap, f".{args.model_type}")
+
+        with open(os.path.join(out_path, "center.txt"), 'w') as f:
+            f.write(' '.join(map(str, (corner_min + corner_max) / 2)))
+        with open(os.path.join(out_path, "extent.txt"), 'w') as f:
+            f.write(' '.join(map(str, corner_max - corner_min)))
+        return False, chunk_blending
+    else:
+        print("Chunk excluded")
+        return True, chunk_blending
 
 if __name__ == '__main__':
-    random.seed(0)
     parser = argparse.ArgumentParser()
     parser.add_argument('--base_dir', required=True)
     parser.add_argument('--images_dir', required=True)
     parser.add_argument('--chunk_size', default=100, type=float)
     parser.add_argument('--min_padd', default=0.2, type=float)
     parser.add_argument('--lapla_thresh', default=1, type=float, help="Discard images if their laplacians are < mean - lapla_thresh * std") # 1
+    parser.add_argument('--lapla_reduction', default=2, type=int, choices=[1, 2, 4, 8], help="Decode the images at 1/lapla_reduction resolution to compute their laplacians")
     parser.add_argument('--min_n_cams', default=100, type=int) # 100
     parser.add_argument('--max_n_cams', default=1500, type=int) # 1500
     parser.add_argument('--output_path', required=True)
     parser.add_argument('--add_far_cams', default=True)
     parser.add_argument('--model_type', default="bin")
+    parser.add_argument('--n_workers', default=1, type=int, help="Number of processes writing the chunks in parallel")
 
     args = parser.parse_args()
 
@@ -50,29 +265,16 @@ if __name__ == '__main__':
             test_cam_names_list = file.readlines()
             blending_dict = {name[:-1] if name[-1] == '\n' else name: {} for name in test_cam_names_list}
 
-    cam_intrinsics, images_metas, points3d = read_model(args.base_dir, ext=f".{args.model_type}")
-
-    cam_centers = np.array([
-        -qvec2rotmat(images_metas[key].qvec).astype(np.float32).T @ images_metas[key].tvec.astype(np.float32)
-        for key in images_metas
-    ])
-
-    n_pts = get_nb_pts(images_metas)
+    cam_intrinsics, images_metas, points3d = read_model(args.base_dir, ext=f".{args.model_type}", points_as_table=True)
 
-    xyzs = np.zeros([n_pts, 3], np.float32)
-    errors = np.zeros([n_pts], np.float32) + 9e9
-    indices = np.zeros([n_pts], np.int64)
-    n_images = np.zeros([n_pts], np.int64)
-    colors = np.zeros([n_pts, 3], np.float32)
+    qvecs, tvecs = image_poses(images_metas)
+    cam_centers = camera_centers(qvecs, tvecs, dtype=np.float32)
 
-    idx = 0    
-    for key in points3d:
-        xyzs[idx] = points3d[key].xyz
-        indices[idx] = points3d[key].id
-        errors[idx] = points3d[key].error
-        colors[idx] = points3d[key].rgb
-        n_images[idx] = len(points3d[key].image_ids)
-        idx +=1
+    xyzs = points3d.xyz.astype(np.float32)
+    errors = points3d.error.astype(np.float32)
+    indices = points3d.ids
+    n_images = points3d.track_lengths()
+    colors = points3d.rgb.astype(np.float32)
 
     mask = errors < 1e1
     # mask *= n_images > 3
@@ -80,22 +282,15 @@ if __name__ == '__main__':
 
     points3d_ordered = np.zeros([indicesC.max()+1, 3])
     points3d_ordered[indicesC] = xyzsC
-    images_points3d = {}
-
-    for key in images_metas:
-        pts_idx = images_metas[key].point3D_ids
-        mask = pts_idx >= 0
-        mask *= pts_idx < len(points3d_ordered)
-        pts_idx = pts_idx[mask]
-        if len(pts_idx) > 0:
-            image_points3d = points3d_ordered[pts_idx]
-            mask = (image_points3d != 0).sum(axis=-1)
-            # images_metas[key]["points3d"] = image_points3d[mask>0]
-            images_points3d[key] = image_points3d[mask>0]
-        else:
-            # images_metas[key]["points3d"] = np.array([])
-            images_points3d[key] = np.array([])
 
+    # all the (image, 3D point) observations of the filtered points
+    obs_image_idx = np.repeat(np.arange(len(images_metas)), [len(images_metas[key].point3D_ids) for key in images_metas])
+    obs_pts_idx = np.concatenate([np.asarray(images_metas[key].point3D_ids, np.int64) for key in images_metas] + [np.zeros(0, np.int64)])
+    mask = (obs_pts_idx >= 0) * (obs_pts_idx < len(points3d_ordered))
+    obs_image_idx, obs_points3d = obs_image_idx[mask], points3d_ordered[obs_pts_idx[mask]]
+    mask = (obs_points3d != 0).sum(axis=-1) > 0
+    obs_image_idx, obs_points3d = obs_image_idx[mask], obs_points3d[mask]
+    n_obs = np.bincount(obs_image_idx, minlength=len(images_metas))
 
     global_bbox = np.stack([cam_centers.min(axis=0), cam_centers.max(axis=0)])
     global_bbox[0, :2] -= args.min_padd * args.chunk_size
@@ -108,152 +303,74 @@ if __name__ == '__main__':
     global_bbox[0, 2] = -1e12
     global_bbox[1, 2] = 1e12
 
-    def get_var_of_laplacian(key):
-        image = cv2.imread(os.path.join(args.images_dir, images_metas[key].name))
-        if image is not None:
-            gray = cv2.cvtColor(image[..., :3], cv2.COLOR_BGR2GRAY)
-            return cv2.Laplacian(gray, cv2.CV_32F).var()
-        else:
-            return 0   
-        
+    extent = global_bbox[1] - global_bbox[0]
+    n_width = round(extent[0] / args.chunk_size)
+    n_height = round(extent[1] / args.chunk_size)
+    x_edges = global_bbox[0, 0] + np.arange(n_width + 1) * args.chunk_size
+    y_edges = global_bbox[0, 1] + np.arange(n_height + 1) * args.chunk_size
+
+    # number of points of each image falling in each chunk, as a sparse (images x cells) matrix
+    obs_cells = grid_cells(obs_points3d, x_edges, y_edges)
+    mask = obs_cells >= 0
+    image_cell_counts = sparse.csc_matrix(
+        (np.ones(mask.sum(), np.int64), (obs_image_idx[mask], obs_cells[mask])),
+        shape=(len(images_metas), n_width * n_height)
+    )
+
     if args.lapla_thresh > 0: 
-        laplacians = Parallel(n_jobs=-1, backend="threading")(
-            delayed(get_var_of_laplacian)(key) for key in images_metas
+        laplacians = read_laplacians(
+            args.images_dir, [images_metas[key].name for key in images_metas],
+            os.path.join(args.base_dir, LAPLACIAN_INDEX_NAME), args.lapla_reduction
         )
-        laplacians_dict = {key: laplacian for key, laplacian in zip(images_metas, laplacians)}
 
+    # per-image data used by the cells: test images only need their 2D-3D links
+    test_point3D_ids = {}
+    if os.path.exists(test_file):
+        test_point3D_ids = {images_metas[key].name: np.asarray(images_metas[key].point3D_ids) for key in images_metas if images_metas[key].name in blending_dict}
+    image_cell_counts.sum_duplicates()
+
+    # group the points by chunk; points on inner chunk borders belong to no chunk
+    order, point_offsets = sort_by_cell(grid_cells(xyzsC, x_edges, y_edges), n_width * n_height)
+    xyzsC, colorsC, errorsC, indicesC = xyzsC[order], colorsC[order], errorsC[order], indicesC[order]
+
+    arrays = {
+        "xyzsC": xyzsC, "colorsC": colorsC, "indicesC": indicesC, "errorsC": errorsC,
+        "cam_centers": cam_centers, "qvecs": qvecs, "tvecs": tvecs, "n_obs": n_obs,
+        "counts_data": image_cell_counts.data, "counts_indices": image_cell_counts.indices, "counts_indptr": image_cell_counts.indptr,
+        "point_offsets": point_offsets,
+    }
+    if args.lapla_thresh > 0:
+        arrays["laplacians"] = laplacians
+    settings = {
+        "args": args, "global_bbox": global_bbox, "n_height": n_height,
+        "cam_intrinsics": cam_intrinsics, "keys": list(images_metas),
+        "names": [images_metas[key].name for key in images_metas],
+        "camera_ids": [images_metas[key].camera_id for key in images_metas],
+        "test_point3D_ids": test_point3D_ids,
+    }
+
+    cells = [(i, j) for i in range(n_width) for j in range(n_height)]
+    if args.n_workers > 1:
+        blocks, specs = share_arrays(arrays)
+        try:
+            with ProcessPoolExecutor(args.n_workers, initializer=init_worker, initargs=(specs, settings)) as executor:
+                results = list(executor.map(make_chunk, *zip(*cells)))
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+    else:
+        chunk_data.update(arrays)
+        chunk_data.update(settings)
+        results = [make_chunk(i, j) for i, j in cells]
+
+    # merge in the order of the sequential loop
     excluded_chunks = []
-    chunks_pcd = {}
-    
-    def make_chunk(i, j, n_width, n_height):
-        # in_path = f"{args.base_dir}/chunk_{i}_{j}"
-        # if os.path.exists(in_path):
-        print(f"chunk {i}_{j}")
-        # corner_min, corner_max = bboxes[i, j, :, 0], bboxes[i, j, :, 1]
-        corner_min = global_bbox[0] + np.array([i * args.chunk_size, j * args.chunk_size, 0])
-        corner_max = global_bbox[0] + np.array([(i + 1) * args.chunk_size, (j + 1) * args.chunk_size, 1e12])
-        corner_min[2] = -1e12
-        corner_max[2] = 1e12
-        
-        corner_min_for_pts = corner_min.copy()
-        corner_max_for_pts = corner_max.copy()
-        if i == 0:
-            corner_min_for_pts[0] = -1e12
-        if j == 0:
-            corner_min_for_pts[1] = -1e12
-        if i == n_width - 1:
-            corner_max_for_pts[0] = 1e12
-        if j == n_height - 1:
-            corner_max_for_pts[1] = 1e12
-
-        mask = np.all(xyzsC < corner_max_for_pts, axis=-1) * np.all(xyzsC > corner_min_for_pts, axis=-1)
-        new_xyzs = xyzsC[mask]
-        new_colors = colorsC[mask]
-        new_indices = indicesC[mask]
-        new_errors = errorsC[mask]
-
-        new_colors = np.clip(new_colors, 0, 255).astype(np.uint8)
-
-        valid_cam = np.all(cam_centers < corner_max, axis=-1) * np.all(cam_centers > corner_min, axis=-1)
-
-        box_center = (corner_max + corner_min) / 2
-        extent = (corner_max - corner_min) / 2
-        acceptable_radius = 2
-        extended_corner_min = box_center - acceptable_radius * extent
-        extended_corner_max = box_center + acceptable_radius * extent
-
-        for cam_idx, key in enumerate(images_metas):
-            # if not valid_cam[cam_idx]:
-            image_points3d =  images_points3d[key]
-            n_pts = (np.all(image_points3d < corner_max_for_pts, axis=-1) * np.all(image_points3d > corner_min_for_pts, axis=-1)).sum() if len(image_points3d) > 0 else 0
-
-            # If within chunk
-            if np.all(cam_centers[cam_idx] < corner_max) and np.all(cam_centers[cam_idx] > corner_min):
-                valid_cam[cam_idx] = n_pts > 50
-            # If within 2x of the chunk
-            elif np.all(cam_centers[cam_idx] < extended_corner_max) and np.all(cam_centers[cam_idx] > extended_corner_min):
-                valid_cam[cam_idx] = n_pts > 50 and random.uniform(0, 1) > 0.5
-            # All distances
-            if (not valid_cam[cam_idx]) and n_pts > 10 and args.add_far_cams:
-                valid_cam[cam_idx] = random.uniform(0, 0.5) < (float(n_pts) / len(image_points3d))
-            
-        print(f"{valid_cam.sum()} valid cameras after visibility-base selection")
-        if args.lapla_thresh > 0:
-            chunk_laplacians = np.array([laplacians_dict[key] for cam_idx, key in enumerate(images_metas) if valid_cam[cam_idx]])
-            laplacian_mean = chunk_laplacians.mean()
-            laplacian_std_dev = chunk_laplacians.std()
-            for cam_idx, key in enumerate(images_metas):
-                if valid_cam[cam_idx] and laplacians_dict[key] < (laplacian_mean - args.lapla_thresh * laplacian_std_dev):
-                    # image = cv2.imread(f"{args.base_dir}/images_masked/{images_metas[key]['name']}")
-                    # cv2.imshow("blurry", image)
-                    # cv2.waitKey(0)
-                    valid_cam[cam_idx] = False
-
-            print(f"{valid_cam.sum()} after Laplacian")
-
-        if valid_cam.sum() > args.max_n_cams:
-            for _ in range(valid_cam.sum() - args.max_n_cams):
-                remove_idx = random.randint(0, valid_cam.sum() - 1)
-                remove_idx_glob = np.arange(len(valid_cam))[valid_cam][remove_idx]
-                valid_cam[remove_idx_glob] = False
-
-            print(f"{valid_cam.sum()} after random removal")
-
-        valid_keys = [key for idx, key in enumerate(images_metas) if valid_cam[idx]]
-        
-        if valid_cam.sum() > args.min_n_cams:# or init_valid_cam.sum() > 0:
-            out_path = os.path.join(args.output_path, f"{i}_{j}")
-            out_colmap = os.path.join(out_path, "sparse", "0")
-            os.makedirs(out_colmap, exist_ok=True)
-
-            # must remove sfm points to use colmap triangulator in following steps
-            images_out = {}
-            for key in valid_keys:
-                image_meta = images_metas[key]
-                images_out[key] = Image(
-                    id = key,
-                    qvec = image_meta.qvec,
-                    tvec = image_meta.tvec,
-                    camera_id = image_meta.camera_id,
-                    name = image_meta.name,
-                    xys = [],
-                    point3D_ids = []
-                )
-
-                if os.path.exists(test_file) and image_meta.name in blending_dict:
-                    n_pts = np.isin(image_meta.point3D_ids, new_indices).sum()
-                    blending_dict[image_meta.name][f"{i}_{j}"] = str(n_pts)
-
-
-            points_out = {
-                new_indices[idx] : Point3D(
-                        id=new_indices[idx],
-                        xyz= new_xyzs[idx],
-                        rgb=new_colors[idx],
-                        error=new_errors[idx],
-                        image_ids=np.array([]),
-                        point2D_idxs=np.array([])
-                    )
-                for idx in range(len(new_xyzs))
-            }
-
-            write_model(cam_intrinsics, images_out, points_out, out_colmap, f".{args.model_type}")
-
-            with open(os.path.join(out_path, "center.txt"), 'w') as f:
-                f.write(' '.join(map(str, (corner_min + corner_max) / 2)))
-            with open(os.path.join(out_path, "extent.txt"), 'w') as f:
-                f.write(' '.join(map(str, corner_max - corner_min)))
-        else:
+    for (i, j), (excluded, chunk_blending) in zip(cells, results):
+        if excluded:
             excluded_chunks.append([i, j])
-            print("Chunk excluded")
-
-    extent = global_bbox[1] - global_bbox[0]
-    n_width = round(extent[0] / args.chunk_size)
-    n_height = round(extent[1] / args.chunk_size)
-
-    for i in range(n_width):
-        for j in range(n_height):
-            make_chunk(i, j, n_width, n_height)
+        for name, n_pts in chunk_blending.items():
+            blending_dict[name][f"{i}_{j}"] = n_pts
 
     if os.path.exists(test_file):
         with open(f"{args.base_dir}/blending_dict.json", "w") as f:
@@ -11,20 +11,9 @@
 
 import numpy as np
 import argparse
-from sklearn.neighbors import NearestNeighbors
 from read_write_model import read_images_binary
-
-def qvec2rotmat(qvec):
-    return np.array([
-        [1 - 2 * qvec[2]**2 - 2 * qvec[3]**2,
-         2 * qvec[1] * qvec[2] - 2 * qvec[0] * qvec[3],
-         2 * qvec[3] * qvec[1] + 2 * qvec[0] * qvec[2]],
-        [2 * qvec[1] * qvec[2] + 2 * qvec[0] * qvec[3],
-         1 - 2 * qvec[1]**2 - 2 * qvec[3]**2,
-         2 * qvec[2] * qvec[3] - 2 * qvec[0] * qvec[1]],
-        [2 * qvec[3] * qvec[1] - 2 * qvec[0] * qvec[2],
-         2 * qvec[2] * qvec[3] + 2 * qvec[0] * qvec[1],
-         1 - 2 * qvec[1]**2 - 2 * qvec[2]**2]])
+from pose_utils import image_poses, camera_centers
+from match_pairs import iter_knn_pairs, PairWriter
 
 def read_images_metas(path):
     """
@@ -55,32 +44,13 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--base_dir', required=True)
     parser.add_argument('--n_neighbours', default=100, type=int)
+    parser.add_argument('--memory_budget', default=1024, type=int, help="Memory used to sort and deduplicate the matches, in MB. Larger match lists are merged on disk")
     args = parser.parse_args()
 
-    images_metas = read_images_binary(f"{args.base_dir}/images.bin")
-    cam_centers = np.array([
-        -qvec2rotmat(images_metas[key].qvec).astype(np.float32).T @ images_metas[key].tvec.astype(np.float32) 
-        for key in images_metas
-    ])
-    n_neighbours = min(args.n_neighbours, len(cam_centers))
-    cam_nbrs = NearestNeighbors(n_neighbors=n_neighbours).fit(cam_centers)
-
-    def get_matches(key, cam_center):
-        _, indices = cam_nbrs.kneighbors(cam_center[None])
-        matches = ""
-        keys = list(images_metas.keys())
-        for idx in indices[0, 1:]:
-            matches += f"{images_metas[key].name} {images_metas[keys[idx]].name}\n" 
-        return matches
-
-    matches = [get_matches(key, cam_center) for key, cam_center in zip(images_metas, cam_centers)]
-    # matches = Parallel(n_jobs=-1, backend="threading")(
-    #     delayed(get_matches)(key, cam_center) for key, cam_center in zip(images_metas, cam_centers)
-    # )
-
-    matches_str = []
-    for match in matches:
-        matches_str.append(match)
+    images_metas = read_images_binary(f"{args.base_dir}/images.bin", fields=("qvec", "tvec", "name"))
+    cam_centers = camera_centers(*image_poses(images_metas), dtype=np.float32)
 
-    with open(f"{args.base_dir}/matching_{args.n_neighbours}.txt", "w") as f:
-        f.write(''.join(matches_str))
\ No newline at end of file
+    names = [images_metas[key].name for key in images_metas]
+    with PairWriter(f"{args.base_dir}/matching_{args.n_neighbours}.txt", names, args.memory_budget * 2**20) as pairs:
+        for block in iter_knn_pairs(cam_centers, args.n_neighbours):
+            pairs.add(block)
@@ -0,0 +1,377 @@
+#
+# Copyright (C) 2024, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+"""Image pairs for COLMAP's matches_importer, over integer image indices.
+
+Images are numbered globally, camera after camera: image k of camera c has
+index offsets[c] + k. Pairs are (N, 2) int64 arrays of such indices and are
+only turned into names when written.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree
+from scipy.spatial import cKDTree
+
+
+def camera_offsets(image_files_organised):
+    """Global index of the first image of each camera, and the total."""
+    offsets = np.zeros(len(image_files_organised) + 1, np.int64)
+    np.cumsum([len(cam['images']) for cam in image_files_organised], out=offsets[1:])
+    return offsets
+
+
+def frame_steps(n_seq_matches_per_view, n_quad_matches_per_view):
+    """Sequential steps 0, 1, ... then quadratic steps n_seq + 2**k - 1."""
+    return np.concatenate([
+        np.arange(n_seq_matches_per_view),
+        n_seq_matches_per_view + 2**np.arange(n_quad_matches_per_view) - 1
+    ]).astype(np.int64)
+
+
+def read_rig_overlaps(path, camera_dirs):
+    """Camera folders sharing some field of view, from a JSON rig file:
+
+        {"overlaps": [{"cameras": ["cam_front_center", "cam_front_left"],
+                       "frame_offset": 0}, ...]}
+
+    frame_offset (default 0) is the index of the frame of the second folder
+    taken at the same time as frame 0 of the first one. Returns
+    {(cam_id, matched_cam_id): frame offset} for cam_id <= matched_cam_id
+    over the indices of camera_dirs; every folder overlaps itself. Folders
+    that are not captured are ignored.
+    """
+    with open(path, 'r') as f:
+        overlaps = json.load(f)['overlaps']
+    cam_ids = {camera_dir: cam_id for cam_id, camera_dir in enumerate(camera_dirs)}
+    rig = {(cam_id, cam_id): 0 for cam_id in range(len(camera_dirs))}
+    for overlap in overlaps:
+        first, second = overlap['cameras']
+        if first in cam_ids and second in cam_ids:
+            frame_offset = overlap.get('frame_offset', 0)
+            if cam_ids[first] <= cam_ids[second]:
+                rig[cam_ids[first], cam_ids[second]] = frame_offset
+            else:
+                rig[cam_ids[second], cam_ids[first]] = -frame_offset
+    return rig
+
+
+def camera_pairs(n_cameras, rig=None):
+    """(cam_id, matched_cam_id, frame offset) of the cameras to match: each
+    camera with itself and the following ones, or with those of the rig."""
+    for cam_id in range(n_cameras):
+        for matched_cam_id in range(cam_id, n_cameras):
+            if rig is None:
+                yield cam_id, matched_cam_id, 0
+            elif (cam_id, matched_cam_id) in rig:
+                yield cam_id, matched_cam_id, rig[cam_id, matched_cam_id]
+
+
+def filter_rig_pairs(pairs, offsets, rig):
+    """Keep the pairs of images of overlapping cameras of the rig."""
+    cam_ids = np.sort(np.searchsorted(offsets, pairs, side="right") - 1, axis=-1)
+    overlapping = np.zeros((len(offsets) - 1, len(offsets) - 1), bool)
+    overlapping[tuple(np.array(list(rig)).T)] = True
+    return pairs[overlapping[cam_ids[:, 0], cam_ids[:, 1]]]
+
+
+def iter_sequential_pairs(offsets, steps, rig=None):
+    """Match frame f of each camera with frame f + step of itself and of the
+    following cameras (of the overlapping ones if a rig is given, shifted by
+    their frame offset). Yields one block of pairs per pair of cameras."""
+    lengths = np.diff(offsets)
+    for cam_id, matched_cam_id, frame_offset in camera_pairs(len(lengths), rig):
+        frames = np.arange(lengths[cam_id])
+        matched_frames = frames[:, None] + steps[None, :] + frame_offset
+        valid = (matched_frames >= 0) & (matched_frames < lengths[matched_cam_id])
+        yield np.stack([
+            offsets[cam_id] + np.broadcast_to(frames[:, None], valid.shape)[valid],
+            offsets[matched_cam_id] + matched_frames[valid]
+        ], axis=-1)
+
+
+def iter_loop_closure_pairs(offsets, loop_matches, rel_matches, rig=None):
+    """Match the frames around loop_match[0] with the frames around
+    loop_match[1], for each camera and the following ones (or the
+    overlapping ones of the rig). Yields one block of pairs per loop and pair
+    of cameras."""
+    lengths = np.diff(offsets)
+    for loop_match in np.asarray(loop_matches, np.int64).reshape(-1, 2):
+        frames = loop_match[0] + rel_matches
+        for cam_id, matched_cam_id, frame_offset in camera_pairs(len(lengths), rig):
+            matched_frames = loop_match[1] + rel_matches + frame_offset
+            current = frames[(frames >= 0) & (frames < lengths[cam_id])]
+            matched = matched_frames[(matched_frames >= 0) & (matched_frames < lengths[matched_cam_id])]
+            current_idx, matched_idx = np.meshgrid(current, matched, indexing="ij")
+            yield np.stack([
+                offsets[cam_id] + current_idx.ravel(),
+                offsets[matched_cam_id] + matched_idx.ravel()
+            ], axis=-1)
+
+
+def iter_knn_pairs(points, n_neighbours, image_idx=None, batch_size=1 << 16, max_distance=np.inf):
+    """Pairs of each point with its nearest points, as n_neighbours
+    neighbours of NearestNeighbors would give them: the first neighbour
+    found, the point itself, is skipped. Neighbours further than
+    max_distance are dropped.
+
+    All the points are queried at once in a KD-tree, by batches of
+    batch_size rows. image_idx maps the points to image indices.
+    """
+    points = np.asarray(points, np.float64)
+    n_neighbours = min(n_neighbours, len(points))
+    if n_neighbours < 2:
+        return
+    tree = cKDTree(points)
+    for start in range(0, len(points), batch_size):
+        _, neighbours = tree.query(points[start:start + batch_size], k=n_neighbours, distance_upper_bound=max_distance, workers=-1)
+        pairs = np.stack([
+            np.repeat(np.arange(start, start + len(neighbours)), n_neighbours - 1),
+            neighbours[:, 1:].ravel()
+        ], axis=-1)
+        # missing neighbours are reported as len(points)
+        pairs = pairs[pairs[:, 1] < len(points)]
+        yield pairs if image_idx is None else np.asarray(image_idx, np.int64)[pairs]
+
+
+def iter_radius_pairs(points, radius, image_idx=None, batch_size=1 << 14):
+    """Pairs of each point with all the points within radius of it, queried
+    in a KD-tree by batches of batch_size rows. image_idx maps the points to
+    image indices."""
+    points = np.asarray(points, np.float64)
+    if len(points) == 0:
+        return
+    tree = cKDTree(points)
+    for start in range(0, len(points), batch_size):
+        neighbours = tree.query_ball_point(points[start:start + batch_size], radius, workers=-1, return_sorted=False)
+        lengths = [len(point_neighbours) for point_neighbours in neighbours]
+        pairs = np.stack([
+            np.repeat(np.arange(start, start + len(neighbours)), lengths),
+            np.concatenate([np.asarray(point_neighbours, np.int64) for point_neighbours in neighbours])
+        ], axis=-1)
+        yield pairs if image_idx is None else np.asarray(image_idx, np.int64)[pairs]
+
+
+def pair_ids(pairs, n_images):
+    """Pack unordered pairs as i * n_images + j with i < j; self matches are
+    dropped."""
+    pairs = np.sort(np.asarray(pairs, np.int64).reshape(-1, 2), axis=-1)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    return pairs[:, 0] * n_images + pairs[:, 1]
+
+
+def unique_pairs(pairs, n_images):
+    """Unordered pairs (i < j) without duplicates nor self matches, sorted."""
+    ids = np.unique(pair_ids(pairs, n_images))
+    return np.stack([ids // n_images, ids % n_images], axis=-1)
+
+
+def pair_scores(pairs, offsets, rig=None, cam_centers=None):
+    """Cost of matching each pair, in frames, lower is better.
+
+    The temporal cost is the frame gap between the two images, less the
+    frame offset of the rig between their cameras. When both images have a
+    position in cam_centers (NaN otherwise), the cost is at most their
+    distance divided by the median distance between consecutive frames, so
+    that revisited places rank like neighbouring frames.
+    """
+    pairs = np.asarray(pairs, np.int64).reshape(-1, 2)
+    cam_ids = np.searchsorted(offsets, pairs, side="right") - 1
+    frames = pairs - offsets[cam_ids]
+    frame_offsets = np.zeros(len(pairs), np.int64)
+    if rig is not None:
+        for (cam_id, matched_cam_id), frame_offset in rig.items():
+            frame_offsets[(cam_ids[:, 0] == cam_id) & (cam_ids[:, 1] == matched_cam_id)] = frame_offset
+            frame_offsets[(cam_ids[:, 0] == matched_cam_id) & (cam_ids[:, 1] == cam_id)] = -frame_offset
+    scores = np.abs(frames[:, 1] - frames[:, 0] - frame_offsets).astype(np.float64)
+
+    if cam_centers is not None:
+        cam_centers = np.asarray(cam_centers, np.float64)
+        consecutive = np.setdiff1d(np.arange(offsets[-1] - 1), offsets[1:] - 1)
+        steps = np.linalg.norm(cam_centers[consecutive + 1] - cam_centers[consecutive], axis=-1)
+        steps = steps[np.isfinite(steps) & (steps > 0)]
+        if len(steps) > 0:
+            distances = np.linalg.norm(cam_centers[pairs[:, 1]] - cam_centers[pairs[:, 0]], axis=-1) / np.median(steps)
+            scores = np.fmin(scores, distances)
+    return scores
+
+
+def prune_pairs(pairs, scores, n_images, max_pairs_per_image=0, max_total_pairs=0):
+    """Keep the best scored unordered pairs, without duplicates.
+
+    A minimum spanning forest of the pairs, by score, is always kept so the
+    matching graph stays as connected as the candidates. Each image also
+    keeps its max_pairs_per_image best pairs, then only the
+    max_total_pairs best of all are kept (0 disables a limit). Returns the
+    (N, 2) kept pairs sorted by id and the number of candidates dropped.
+    """
+    pairs = np.sort(np.asarray(pairs, np.int64).reshape(-1, 2), axis=-1)
+    valid = pairs[:, 0] != pairs[:, 1]
+    ids = pairs[valid, 0] * n_images + pairs[valid, 1]
+    scores = np.asarray(scores, np.float64)[valid]
+
+    # best score of each pair
+    order = np.lexsort((scores, ids))
+    ids, scores = ids[order], scores[order]
+    first = np.ones(len(ids), bool)
+    first[1:] = ids[1:] != ids[:-1]
+    ids, scores = ids[first], scores[first]
+    first_idx, second_idx = ids // n_images, ids % n_images
+
+    # zero weights are missing edges for csgraph
+    weights = scores - scores.min() + 1 if len(scores) > 0 else scores
+    tree = minimum_spanning_tree(coo_matrix((weights, (first_idx, second_idx)), shape=(n_images, n_images))).tocoo()
+    tree_ids = np.minimum(tree.row, tree.col).astype(np.int64) * n_images + np.maximum(tree.row, tree.col)
+    in_tree = np.isin(ids, tree_ids)
+
+    keep = np.ones(len(ids), bool)
+    if max_pairs_per_image > 0:
+        # rank of each pair among the pairs of each of its images
+        ends = np.concatenate([first_idx, second_idx])
+        edges = np.tile(np.arange(len(ids)), 2)
+        order = np.lexsort((np.tile(scores, 2), ends))
+        ranks = np.arange(len(order)) - np.searchsorted(ends[order], ends[order])
+        keep = in_tree.copy()
+        keep[edges[order][ranks < max_pairs_per_image]] = True
+    if max_total_pairs > 0 and keep.sum() > max_total_pairs:
+        candidates = np.flatnonzero(keep & ~in_tree)
+        best = candidates[np.argsort(scores[candidates], kind="stable")[:max(max_total_pairs - in_tree.sum(), 0)]]
+        keep = in_tree.copy()
+        keep[best] = True
+
+    return np.stack([first_idx[keep], second_idx[keep]], axis=-1), len(ids) - keep.sum()
+
+
+class PairWriter:
+    """Write "name1 name2" lines for unordered pairs, sorted and without
+    duplicates, in bounded memory.
+
+    Added pairs are buffered as packed ids. When the buffer exceeds
+    memory_budget bytes it is sorted, deduplicated and spilled to a
+    temporary file; close() merges these sorted runs block by block.
+
+    With max_pairs_per_image or max_total_pairs, the pairs and their scores
+    are kept in memory instead and pruned by prune_pairs on close(). Pairs
+    added without scores are scored by scorer (by default 0, the best).
+    """
+
+    def __init__(self, path, names, memory_budget=1 << 30, tmp_dir=None, max_pairs_per_image=0, max_total_pairs=0, scorer=None):
+        self.path = path
+        self.names = names
+        self.n_images = len(names)
+        # sorting the buffer takes about twice its size
+        self.buffer_size = max(memory_budget // 8 // 3, 1 << 16)
+        self.tmp_dir = tmp_dir if tmp_dir is not None else os.path.dirname(os.path.abspath(path))
+        self.buffer = []
+        self.buffered = 0
+        self.run_dir = None
+        self.runs = []
+        self.n_pairs = 0
+        self.max_pairs_per_image = max_pairs_per_image
+        self.max_total_pairs = max_total_pairs
+        self.pruning = max_pairs_per_image > 0 or max_total_pairs > 0
+        self.scorer = scorer
+        self.scores = []
+        self.n_dropped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.cleanup()
+
+    def add(self, pairs, scores=None):
+        if self.pruning:
+            pairs = np.asarray(pairs, np.int64).reshape(-1, 2)
+            self.buffer.append(pairs)
+            self.scores.append(np.full(len(pairs), np.nan) if scores is None else np.asarray(scores, np.float64))
+            return
+        ids = pair_ids(pairs, self.n_images)
+        self.buffer.append(ids)
+        self.buffered += len(ids)
+        if self.buffered >= self.buffer_size:
+            self.spill()
+
+    def spill(self):
+        ids = np.unique(np.concatenate(self.buffer + [np.zeros(0, np.int64)]))
+        self.buffer, self.buffered = [], 0
+        if self.run_dir is None:
+            self.run_dir = tempfile.mkdtemp(prefix="pairs_", dir=self.tmp_dir)
+        run_path = os.path.join(self.run_dir, f"{len(self.runs)}.bin")
+        ids.tofile(run_path)
+        self.runs.append((run_path, len(ids)))
+
+    def merged_blocks(self):
+        """Yield the sorted unique ids of all the runs, block by block."""
+        block_size = max(self.buffer_size // len(self.runs), 1 << 12)
+        files = [open(run_path, "rb") for run_path, _ in self.runs]
+        remaining = [n_ids for _, n_ids in self.runs]
+        chunks = [np.zeros(0, np.int64) for _ in self.runs]
+        try:
+            while True:
+                for run, f in enumerate(files):
+                    if len(chunks[run]) == 0 and remaining[run] > 0:
+                        chunks[run] = np.fromfile(f, np.int64, min(block_size, remaining[run]))
+                        remaining[run] -= len(chunks[run])
+                active = [run for run in range(len(files)) if len(chunks[run]) > 0]
+                if not active:
+                    return
+                # every id <= threshold of all the runs is loaded: the
+                # unread part of a run is above the last id of its chunk
+                threshold = min(chunks[run][-1] for run in active)
+                block = []
+                for run in active:
+                    end = np.searchsorted(chunks[run], threshold, side="right")
+                    block.append(chunks[run][:end])
+                    chunks[run] = chunks[run][end:]
+                yield np.unique(np.concatenate(block))
+        finally:
+            for f in files:
+                f.close()
+
+    def close(self):
+        try:
+            if self.pruning:
+                pairs = np.concatenate(self.buffer + [np.zeros((0, 2), np.int64)])
+                scores = np.concatenate(self.scores + [np.zeros(0)])
+                self.buffer, self.scores = [], []
+                unscored = np.isnan(scores)
+                scores[unscored] = 0 if self.scorer is None else self.scorer(pairs[unscored])
+                pairs, self.n_dropped = prune_pairs(pairs, scores, self.n_images, self.max_pairs_per_image, self.max_total_pairs)
+                blocks = [pairs[:, 0] * self.n_images + pairs[:, 1]]
+            elif self.runs:
+                self.spill()
+                blocks = self.merged_blocks()
+            else:
+                blocks = [np.unique(np.concatenate(self.buffer + [np.zeros(0, np.int64)]))]
+                self.buffer = []
+            with open(self.path, "w") as f:
+                for ids in blocks:
+                    for start in range(0, len(ids), 1 << 20):
+                        batch = ids[start:start + (1 << 20)]
+                        pairs = np.stack([batch // self.n_images, batch % self.n_images], axis=-1)
+                        f.write(''.join(f"{self.names[i]} {self.names[j]}\n" for i, j in pairs.tolist()))
+                        self.n_pairs += len(batch)
+        finally:
+            self.cleanup()
+
+    def cleanup(self):
+        if self.run_dir is not None:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+            self.run_dir = None
+        self.runs = []
@@ -0,0 +1,117 @@
+#
+# Copyright (C) 2024, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+"""Resumable pipelines: stages that are up to date are skipped on rerun.
+
+Each stage declares the files or directories it reads and writes. When a
+stage succeeds, a marker recording the fingerprint (paths, sizes and mtimes)
+of its inputs and its parameters is written. On rerun the stage is skipped
+if the marker matches and its outputs exist; a stage whose upstream stage
+ran again sees new inputs and runs again too.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import subprocess
+from gps_priors import EXIF_GPS_INDEX_NAME
+
+# caches that stages write next to their inputs, and the temporary files
+# of their atomic writes: they do not make the inputs change
+CACHE_FILE_NAMES = {EXIF_GPS_INDEX_NAME}
+TMP_SUFFIX = ".tmp"
+
+
+def fingerprint(paths):
+    """Hash of the (path, size, mtime) of the files at or under paths;
+    missing paths are part of the hash. Cache and temporary files in
+    directories are ignored."""
+    entries = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if filename in CACHE_FILE_NAMES or filename.endswith(TMP_SUFFIX):
+                        continue
+                    file_path = os.path.join(dirpath, filename)
+                    stat = os.stat(file_path)
+                    entries.append([file_path, stat.st_size, stat.st_mtime_ns])
+        elif os.path.exists(path):
+            stat = os.stat(path)
+            entries.append([path, stat.st_size, stat.st_mtime_ns])
+        else:
+            entries.append([path, -1, -1])
+    return hashlib.sha1(json.dumps(entries).encode()).hexdigest()
+
+
+class StageRunner:
+    """Run the stages of a pipeline in order, skipping the up to date ones.
+
+    Markers are written to marker_dir. All the stages from rerun_from on
+    (a stage name) are run regardless of their markers.
+    """
+
+    def __init__(self, marker_dir, rerun_from=None):
+        self.marker_dir = marker_dir
+        self.rerun_from = rerun_from
+        self.forced = False
+        os.makedirs(marker_dir, exist_ok=True)
+
+    def marker_path(self, name):
+        return os.path.join(self.marker_dir, f"{name}.json")
+
+    def is_up_to_date(self, name, inputs, outputs, params):
+        if not os.path.exists(self.marker_path(name)):
+            return False
+        with open(self.marker_path(name), 'r') as f:
+            marker = json.load(f)
+        return (
+            marker["params"] == params
+            and marker["inputs"] == fingerprint(inputs)
+            and all(os.path.exists(output) for output in outputs)
+        )
+
+    def run(self, name, command, inputs=(), outputs=(), params=None):
+        """Run a stage unless it is up to date. command is the argument
+        list of a subprocess or a function; params (by default the argument
+        list) are the settings that make the stage run again when changed.
+
+        Stages that modify their inputs in place (e.g. a database) are
+        supported: the inputs are fingerprinted after the stage ran.
+        """
+        params = json.dumps(command if params is None else params)
+        self.forced |= name == self.rerun_from
+        if not self.forced and self.is_up_to_date(name, inputs, outputs, params):
+            print(f"{name} is up to date, skipping it.")
+            return
+
+        # a stage that fails or is interrupted must run again
+        if os.path.exists(self.marker_path(name)):
+            os.remove(self.marker_path(name))
+        start_time = time.time()
+        try:
+            if callable(command):
+                command()
+            else:
+                subprocess.run(command, check=True)
+        except subprocess.CalledProcessError as e:
+            print(f"Error executing {name}: {e}")
+            sys.exit(1)
+
+        with open(self.marker_path(name), 'w') as f:
+            json.dump({
+                "params": params,
+                "inputs": fingerprint(inputs),
+                "duration": time.time() - start_time,
+            }, f)
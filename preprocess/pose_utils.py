@@ -0,0 +1,87 @@
+#
+# Copyright (C) 2024, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+"""Batched versions of the pose helpers of read_write_model.
+
+All functions operate on stacked arrays: qvecs (N, 4) as (w, x, y, z),
+tvecs (N, 3) and rotations (N, 3, 3), with COLMAP's world-to-camera
+convention x_cam = R @ x_world + t.
+"""
+
+import numpy as np
+
+
+def image_poses(images):
+    """Stack the qvecs and tvecs of an images dict, in dict order."""
+    qvecs = np.array([images[key].qvec for key in images], np.float64)
+    tvecs = np.array([images[key].tvec for key in images], np.float64)
+    return qvecs.reshape(-1, 4), tvecs.reshape(-1, 3)
+
+
+def qvecs2rotmats(qvecs):
+    qvecs = np.asarray(qvecs, np.float64).reshape(-1, 4)
+    w, x, y, z = qvecs.T
+    R = np.empty((len(qvecs), 3, 3))
+    R[:, 0, 0] = 1 - 2 * y**2 - 2 * z**2
+    R[:, 0, 1] = 2 * x * y - 2 * w * z
+    R[:, 0, 2] = 2 * z * x + 2 * w * y
+    R[:, 1, 0] = 2 * x * y + 2 * w * z
+    R[:, 1, 1] = 1 - 2 * x**2 - 2 * z**2
+    R[:, 1, 2] = 2 * y * z - 2 * w * x
+    R[:, 2, 0] = 2 * z * x - 2 * w * y
+    R[:, 2, 1] = 2 * y * z + 2 * w * x
+    R[:, 2, 2] = 1 - 2 * x**2 - 2 * y**2
+    return R
+
+
+def rotmats2qvecs(R):
+    """Same method as rotmat2qvec (largest eigenvector of K), batched."""
+    R = np.asarray(R, np.float64).reshape(-1, 3, 3)
+    Rxx, Ryx, Rzx = R[:, 0, 0], R[:, 0, 1], R[:, 0, 2]
+    Rxy, Ryy, Rzy = R[:, 1, 0], R[:, 1, 1], R[:, 1, 2]
+    Rxz, Ryz, Rzz = R[:, 2, 0], R[:, 2, 1], R[:, 2, 2]
+    K = np.zeros((len(R), 4, 4))
+    K[:, 0, 0] = Rxx - Ryy - Rzz
+    K[:, 1, 0] = Ryx + Rxy
+    K[:, 1, 1] = Ryy - Rxx - Rzz
+    K[:, 2, 0] = Rzx + Rxz
+    K[:, 2, 1] = Rzy + Ryz
+    K[:, 2, 2] = Rzz - Rxx - Ryy
+    K[:, 3, 0] = Ryz - Rzy
+    K[:, 3, 1] = Rzx - Rxz
+    K[:, 3, 2] = Rxy - Ryx
+    K[:, 3, 3] = Rxx + Ryy + Rzz
+    K /= 3.0
+    # eigh only reads the lower triangle
+    eigvals, eigvecs = np.linalg.eigh(K)
+    best = np.argmax(eigvals, axis=-1)
+    qvecs = eigvecs[np.arange(len(R))[:, None], [3, 0, 1, 2], best[:, None]]
+    qvecs[qvecs[:, 0] < 0] *= -1
+    return qvecs
+
+
+def camera_centers(qvecs, tvecs, dtype=np.float64):
+    """Camera centers -R^T @ t, computed in dtype."""
+    R = qvecs2rotmats(qvecs).astype(dtype)
+    tvecs = np.asarray(tvecs).astype(dtype)
+    return -np.einsum("nji,nj->ni", R, tvecs)
+
+
+def transform_poses(qvecs, tvecs, scale=1.0, rotation=np.eye(3), translation=np.zeros(3)):
+    """Update world-to-camera poses after the world is transformed by the
+    similarity x' = scale * rotation @ x + translation.
+
+    Returns the new (qvecs, tvecs). The camera frame is scaled with the
+    world so that the new poses stay rigid.
+    """
+    R = qvecs2rotmats(qvecs) @ np.linalg.inv(rotation)
+    tvecs = scale * np.asarray(tvecs, np.float64) - R @ np.asarray(translation, np.float64)
+    return rotmats2qvecs(R), tvecs
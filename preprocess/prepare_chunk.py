@@ -13,7 +13,8 @@ import os, sys, shutil
 import subprocess
 import argparse
 import time, platform
-from read_write_model import write_points3D_binary
+from read_write_model import read_images_binary, write_points3D_binary
+from database import COLMAPDatabase
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -21,6 +22,8 @@ if __name__ == '__main__':
     parser.add_argument('--out_chunk', type=str, help='Output chunk', required=True)
     parser.add_argument('--images_dir', type=str, help='Images directory', required=True)
     parser.add_argument('--skip_bundle_adjustment', action="store_true", default=False)
+    parser.add_argument('--global_database', type=str, default=None, help='Database with the features of all the rectified images (same PINHOLE cameras as the chunks), copied instead of extracting them again. The unrectified database of generate_colmap.py does not qualify, its cameras are distorted')
+    parser.add_argument('--reuse_matches', action="store_true", default=False, help='Also copy the matches between the chunk images from --global_database, only the missing ones are computed')
     args = parser.parse_args()
 
     matching_nb = 50 if args.skip_bundle_adjustment else 200
@@ -71,19 +74,32 @@ if __name__ == '__main__':
         print(f"Error executing image_undistorter: {e}")
         sys.exit(1)
 
-    print("extracting features...")
-    colmap_feature_extractor_args = [
-        colmap_exe, "feature_extractor",
-        "--database_path", f"{bundle_adj_chunk}/database.db",
-        "--image_path", f"{bundle_adj_chunk}/images",
-        "--ImageReader.existing_camera_id", "1",
-        ]
-    
-    try:
-        subprocess.run(colmap_feature_extractor_args, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing colmap feature_extractor: {e}")
-        sys.exit(1)
+    reuse_features = False
+    if args.global_database is not None:
+        chunk_images = read_images_binary(os.path.join(args.raw_chunk, "sparse", "0", "images.bin"), fields=("name",))
+        db = COLMAPDatabase.connect(f"{bundle_adj_chunk}/database.db")
+        try:
+            n_images = db.copy_images_from(args.global_database, [image_meta.name for image_meta in chunk_images.values()], matches=args.reuse_matches)
+            reuse_features = True
+            print(f"copied the features of {n_images} images from {args.global_database}")
+        except ValueError as e:
+            print(f"Cannot reuse the features of {args.global_database}, extracting them: {e}")
+        db.close()
+
+    if not reuse_features:
+        print("extracting features...")
+        colmap_feature_extractor_args = [
+            colmap_exe, "feature_extractor",
+            "--database_path", f"{bundle_adj_chunk}/database.db",
+            "--image_path", f"{bundle_adj_chunk}/images",
+            "--ImageReader.existing_camera_id", "1",
+            ]
+
+        try:
+            subprocess.run(colmap_feature_extractor_args, check=True)
+        except subprocess.CalledProcessError as e:
+            print(f"Error executing colmap feature_extractor: {e}")
+            sys.exit(1)
 
     print("feature matching...")
     colmap_matches_importer_args = [
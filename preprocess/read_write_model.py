@@ -29,6 +29,8 @@
 
 
 import os
+import mmap
+import hashlib
 import collections
 import numpy as np
 import struct
@@ -47,6 +49,18 @@ BaseImage = collections.namedtuple(
 Point3D = collections.namedtuple(
     "Point3D", ["id", "xyz", "rgb", "error", "image_ids", "point2D_idxs"]
 )
+BasePointCloudTable = collections.namedtuple(
+    "PointCloudTable",
+    [
+        "ids",
+        "xyz",
+        "rgb",
+        "error",
+        "track_offsets",
+        "track_image_ids",
+        "track_point2D_idxs",
+    ],
+)
 
 
 class Image(BaseImage):
@@ -54,6 +68,105 @@ class Image(BaseImage):
         return qvec2rotmat(self.qvec)
 
 
+class PointCloudTable(BasePointCloudTable):
+    """Columnar (struct-of-arrays) representation of points3D.
+
+    Point k has id ids[k], position xyz[k], color rgb[k] and error error[k].
+    Its track is stored CSR-style: the image ids and 2D point indices of its
+    observations are track_image_ids[track_offsets[k]:track_offsets[k + 1]]
+    and track_point2D_idxs[track_offsets[k]:track_offsets[k + 1]].
+    """
+
+    @property
+    def num_points(self):
+        return len(self.ids)
+
+    def track_lengths(self):
+        return np.diff(self.track_offsets)
+
+    def select(self, mask):
+        """Return the sub-table of points selected by a boolean mask or
+        an array of indices, with their tracks."""
+        indices = np.asarray(mask)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        lengths = self.track_lengths()[indices]
+        track_offsets = np.zeros(len(indices) + 1, np.int64)
+        np.cumsum(lengths, out=track_offsets[1:])
+        track_elems = np.repeat(
+            self.track_offsets[indices] - track_offsets[:-1], lengths
+        ) + np.arange(track_offsets[-1])
+        return PointCloudTable(
+            ids=self.ids[indices],
+            xyz=self.xyz[indices],
+            rgb=self.rgb[indices],
+            error=self.error[indices],
+            track_offsets=track_offsets,
+            track_image_ids=self.track_image_ids[track_elems],
+            track_point2D_idxs=self.track_point2D_idxs[track_elems],
+        )
+
+    @classmethod
+    def from_arrays(cls, ids, xyz, rgb, error):
+        """Build a table of points without tracks."""
+        return cls(
+            ids=np.asarray(ids, np.int64),
+            xyz=np.asarray(xyz, np.float64).reshape(-1, 3),
+            rgb=np.asarray(rgb, np.uint8).reshape(-1, 3),
+            error=np.asarray(error, np.float64),
+            track_offsets=np.zeros(len(ids) + 1, np.int64),
+            track_image_ids=np.zeros(0, np.int32),
+            track_point2D_idxs=np.zeros(0, np.int32),
+        )
+
+    @classmethod
+    def from_points3D(cls, points3D):
+        num_points = len(points3D)
+        points = points3D.values()
+        lengths = np.fromiter(
+            (len(pt.image_ids) for pt in points), np.int64, num_points
+        )
+        track_offsets = np.zeros(num_points + 1, np.int64)
+        np.cumsum(lengths, out=track_offsets[1:])
+        if num_points > 0:
+            xyz = np.array([np.asarray(pt.xyz, np.float64) for pt in points])
+            rgb = np.array([np.asarray(pt.rgb) for pt in points])
+            track_image_ids = np.concatenate([pt.image_ids for pt in points])
+            track_point2D_idxs = np.concatenate(
+                [pt.point2D_idxs for pt in points]
+            )
+        else:
+            xyz = rgb = track_image_ids = track_point2D_idxs = np.zeros(0)
+        return cls(
+            ids=np.fromiter((pt.id for pt in points), np.int64, num_points),
+            xyz=xyz.reshape(-1, 3),
+            rgb=rgb.astype(np.uint8).reshape(-1, 3),
+            error=np.fromiter(
+                (float(pt.error) for pt in points), np.float64, num_points
+            ),
+            track_offsets=track_offsets,
+            track_image_ids=track_image_ids.astype(np.int32),
+            track_point2D_idxs=track_point2D_idxs.astype(np.int32),
+        )
+
+    def to_points3D(self):
+        image_ids = np.split(self.track_image_ids, self.track_offsets[1:-1])
+        point2D_idxs = np.split(
+            self.track_point2D_idxs, self.track_offsets[1:-1]
+        )
+        points3D = {}
+        for idx, point3D_id in enumerate(self.ids.tolist()):
+            points3D[point3D_id] = Point3D(
+                id=point3D_id,
+                xyz=self.xyz[idx],
+                rgb=self.rgb[idx],
+                error=self.error[idx],
+                image_ids=image_ids[idx],
+                point2D_idxs=point2D_idxs[idx],
+            )
+        return points3D
+
+
 CAMERA_MODELS = {
     CameraModel(model_id=0, model_name="SIMPLE_PINHOLE", num_params=3),
     CameraModel(model_id=1, model_name="PINHOLE", num_params=4),
@@ -73,6 +186,22 @@ CAMERA_MODEL_IDS = dict(
 CAMERA_MODEL_NAMES = dict(
     [(camera_model.model_name, camera_model) for camera_model in CAMERA_MODELS]
 )
+# On-disk layout of one 2D observation in images.bin: (X, Y, POINT3D_ID)
+POINT2D_DTYPE = np.dtype([("x", "<f8"), ("y", "<f8"), ("id", "<i8")])
+# On-disk layout of a points3D.bin record, followed by TRACK_LENGTH elements
+POINT3D_RECORD_DTYPE = np.dtype(
+    [
+        ("id", "<u8"),
+        ("xyz", "<f8", (3,)),
+        ("rgb", "u1", (3,)),
+        ("error", "<f8"),
+        ("track_length", "<u8"),
+    ]
+)
+TRACK_ELEM_DTYPE = np.dtype([("image_id", "<i4"), ("point2D_idx", "<i4")])
+# Sidecar written next to a model by read_model(..., use_cache=True)
+MODEL_CACHE_NAME = "model_cache.npz"
+MODEL_CACHE_VERSION = 1
 
 
 def read_next_bytes(fid, num_bytes, format_char_sequence, endian_character="<"):
@@ -103,6 +232,35 @@ def write_next_bytes(fid, data, format_char_sequence, endian_character="<"):
     fid.write(bytes)
 
 
+def gather_records(buffer, offsets, dtype, batch_size=1 << 20):
+    """Gather fixed-size records starting at arbitrary byte offsets.
+    :param buffer: uint8 array holding the file contents.
+    :param offsets: Byte offset of every record.
+    :param dtype: Packed structured dtype of one record.
+    :param batch_size: Records copied per step, bounds temporary memory.
+    :return: Structured array of len(offsets) records.
+    """
+    records = np.empty(len(offsets), dtype=dtype)
+    records_bytes = records.view(np.uint8).reshape(-1, dtype.itemsize)
+    span = np.arange(dtype.itemsize)
+    for start in range(0, len(offsets), batch_size):
+        batch = offsets[start : start + batch_size]
+        stop = start + len(batch)
+        records_bytes[start:stop] = buffer[batch[:, None] + span]
+    return records
+
+
+def scatter_records(buffer, offsets, records, batch_size=1 << 20):
+    """Inverse of gather_records: copy records to arbitrary byte offsets."""
+    itemsize = records.dtype.itemsize
+    records_bytes = records.view(np.uint8).reshape(-1, itemsize)
+    span = np.arange(itemsize)
+    for start in range(0, len(offsets), batch_size):
+        batch = offsets[start : start + batch_size]
+        stop = start + len(batch)
+        buffer[batch[:, None] + span] = records_bytes[start:stop]
+
+
 def read_cameras_text(path):
     """
     see: src/colmap/scene/reconstruction.cc
@@ -244,55 +402,130 @@ def read_images_text(path):
     return images
 
 
-def read_images_binary(path_to_model_file):
+def points2D_views(buffer, offset, num_points2D):
+    """Return (xys, point3D_ids) views over the num_points2D observations
+    stored at byte offset of an images.bin buffer."""
+    xys = np.ndarray(
+        shape=(num_points2D, 2),
+        dtype="<f8",
+        buffer=buffer,
+        offset=offset,
+        strides=(POINT2D_DTYPE.itemsize, 8),
+    )
+    point3D_ids = np.frombuffer(
+        buffer, dtype=POINT2D_DTYPE, count=num_points2D, offset=offset
+    )["id"]
+    return xys, point3D_ids
+
+
+def iter_images_binary(buffer):
+    """Walk the image records of an images.bin buffer without decoding the
+    2D observations. Yields (image_id, qvec, tvec, camera_id, name,
+    points2D_offset, num_points2D) where qvec and tvec are tuples."""
+    unpack_properties = struct.Struct("<idddddddi").unpack_from
+    unpack_num_points2D = struct.Struct("<Q").unpack_from
+    offset = 0
+    num_reg_images = unpack_num_points2D(buffer, offset)[0]
+    offset += 8
+    for _ in range(num_reg_images):
+        binary_image_properties = unpack_properties(buffer, offset)
+        offset += 64
+        name_end = buffer.find(b"\x00", offset)  # look for the ASCII 0 entry
+        image_name = buffer[offset:name_end].decode("utf-8")
+        offset = name_end + 1
+        num_points2D = unpack_num_points2D(buffer, offset)[0]
+        offset += 8
+        yield (
+            binary_image_properties[0],
+            binary_image_properties[1:5],
+            binary_image_properties[5:8],
+            binary_image_properties[8],
+            image_name,
+            offset,
+            num_points2D,
+        )
+        # skip the 2D observations
+        offset += POINT2D_DTYPE.itemsize * num_points2D
+
+
+def read_images_binary(path_to_model_file, fields=None):
     """
     see: src/colmap/scene/reconstruction.cc
         void Reconstruction::ReadImagesBinary(const std::string& path)
         void Reconstruction::WriteImagesBinary(const std::string& path)
+
+    The file is memory-mapped and the 2D observations of each image are
+    returned as read-only views into the mapping (no per-point unpacking).
+
+    :param fields: Image fields to decode, e.g. ("qvec", "tvec", "name").
+    Other fields are set to None; if neither "xys" nor "point3D_ids" is
+    requested, the observation blocks are skipped without being touched.
+    All fields are decoded by default.
     """
+    fields = BaseImage._fields if fields is None else tuple(fields)
+    unknown_fields = set(fields) - set(BaseImage._fields)
+    if unknown_fields:
+        raise ValueError(f"Unknown image fields: {sorted(unknown_fields)}")
+    load_qvec = "qvec" in fields
+    load_tvec = "tvec" in fields
+    load_camera_id = "camera_id" in fields
+    load_name = "name" in fields
+    load_xys = "xys" in fields
+    load_point3D_ids = "point3D_ids" in fields
+
     images = {}
     with open(path_to_model_file, "rb") as fid:
-        num_reg_images = read_next_bytes(fid, 8, "Q")[0]
-        for _ in range(num_reg_images):
-            binary_image_properties = read_next_bytes(
-                fid, num_bytes=64, format_char_sequence="idddddddi"
-            )
-            image_id = binary_image_properties[0]
-            qvec = np.array(binary_image_properties[1:5])
-            tvec = np.array(binary_image_properties[5:8])
-            camera_id = binary_image_properties[8]
-            image_name = ""
-            current_char = read_next_bytes(fid, 1, "c")[0]
-            while current_char != b"\x00":  # look for the ASCII 0 entry
-                image_name += current_char.decode("utf-8")
-                current_char = read_next_bytes(fid, 1, "c")[0]
-            num_points2D = read_next_bytes(
-                fid, num_bytes=8, format_char_sequence="Q"
-            )[0]
-            x_y_id_s = read_next_bytes(
-                fid,
-                num_bytes=24 * num_points2D,
-                format_char_sequence="ddq" * num_points2D,
-            )
-            xys = np.column_stack(
-                [
-                    tuple(map(float, x_y_id_s[0::3])),
-                    tuple(map(float, x_y_id_s[1::3])),
-                ]
-            )
-            point3D_ids = np.array(tuple(map(int, x_y_id_s[2::3])))
-            images[image_id] = Image(
-                id=image_id,
-                qvec=qvec,
-                tvec=tvec,
-                camera_id=camera_id,
-                name=image_name,
-                xys=xys,
-                point3D_ids=point3D_ids,
+        data = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+    for (
+        image_id,
+        qvec,
+        tvec,
+        camera_id,
+        image_name,
+        points2D_offset,
+        num_points2D,
+    ) in iter_images_binary(data):
+        xys = point3D_ids = None
+        if load_xys or load_point3D_ids:
+            xys, point3D_ids = points2D_views(
+                data, points2D_offset, num_points2D
             )
+        images[image_id] = Image(
+            id=image_id,
+            qvec=np.array(qvec) if load_qvec else None,
+            tvec=np.array(tvec) if load_tvec else None,
+            camera_id=camera_id if load_camera_id else None,
+            name=image_name if load_name else None,
+            xys=xys if load_xys else None,
+            point3D_ids=point3D_ids if load_point3D_ids else None,
+        )
+    if not (load_xys or load_point3D_ids):
+        data.close()
     return images
 
 
+def read_images_binary_index(path_to_model_file):
+    """Map every image id of an images.bin file to the (byte offset, count)
+    of its 2D observations, for use with read_image_points2D."""
+    with open(path_to_model_file, "rb") as fid:
+        with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return {
+                image_id: (points2D_offset, num_points2D)
+                for image_id, _, _, _, _, points2D_offset, num_points2D in (
+                    iter_images_binary(data)
+                )
+            }
+
+
+def read_image_points2D(path_to_model_file, points2D_offset, num_points2D):
+    """Read the (xys, point3D_ids) of a single image located with
+    read_images_binary_index."""
+    with open(path_to_model_file, "rb") as fid:
+        fid.seek(points2D_offset)
+        data = fid.read(POINT2D_DTYPE.itemsize * num_points2D)
+    return points2D_views(data, 0, num_points2D)
+
+
 def write_images_text(images, path):
     """
     see: src/colmap/scene/reconstruction.cc
@@ -338,20 +571,29 @@ def write_images_binary(images, path_to_model_file):
     see: src/colmap/scene/reconstruction.cc
         void Reconstruction::ReadImagesBinary(const std::string& path)
         void Reconstruction::WriteImagesBinary(const std::string& path)
+
+    The 2D observations of each image are packed into one POINT2D_DTYPE
+    buffer and the whole file is emitted with a single write.
     """
+    pack_properties = struct.Struct("<idddddddi").pack
+    pack_num_points2D = struct.Struct("<Q").pack
+    blocks = [pack_num_points2D(len(images))]
+    for _, img in images.items():
+        xys = np.asarray(img.xys, dtype=np.float64).reshape(-1, 2)
+        points2D = np.empty(len(img.point3D_ids), dtype=POINT2D_DTYPE)
+        points2D["x"] = xys[:, 0]
+        points2D["y"] = xys[:, 1]
+        points2D["id"] = img.point3D_ids
+        blocks.append(
+            pack_properties(
+                img.id, *img.qvec.tolist(), *img.tvec.tolist(), img.camera_id
+            )
+        )
+        blocks.append(img.name.encode("utf-8") + b"\x00")
+        blocks.append(pack_num_points2D(len(points2D)))
+        blocks.append(points2D.tobytes())
     with open(path_to_model_file, "wb") as fid:
-        write_next_bytes(fid, len(images), "Q")
-        for _, img in images.items():
-            write_next_bytes(fid, img.id, "i")
-            write_next_bytes(fid, img.qvec.tolist(), "dddd")
-            write_next_bytes(fid, img.tvec.tolist(), "ddd")
-            write_next_bytes(fid, img.camera_id, "i")
-            for char in img.name:
-                write_next_bytes(fid, char.encode("utf-8"), "c")
-            write_next_bytes(fid, b"\x00", "c")
-            write_next_bytes(fid, len(img.point3D_ids), "Q")
-            for xy, p3d_id in zip(img.xys, img.point3D_ids):
-                write_next_bytes(fid, [*xy, p3d_id], "ddq")
+        fid.write(b"".join(blocks))
 
 
 def read_points3D_text(path):
@@ -424,6 +666,89 @@ def read_points3D_binary(path_to_model_file):
     return points3D
 
 
+def read_points3D_binary_table(path_to_model_file):
+    """
+    Same as read_points3D_binary, but returns a PointCloudTable.
+
+    Only the track lengths are walked record by record to locate the
+    records; all fields and tracks are then gathered in bulk.
+    """
+    with open(path_to_model_file, "rb") as fid:
+        buffer = np.frombuffer(fid.read(), dtype=np.uint8)
+    num_points = int(buffer[:8].view("<u8")[0])
+    unpack_track_length = struct.Struct("<Q").unpack_from
+    length_offset = POINT3D_RECORD_DTYPE.fields["track_length"][1]
+    record_size = POINT3D_RECORD_DTYPE.itemsize
+    record_offsets = []
+    offset = 8
+    for _ in range(num_points):
+        record_offsets.append(offset)
+        track_length = unpack_track_length(buffer, offset + length_offset)[0]
+        offset += record_size + TRACK_ELEM_DTYPE.itemsize * track_length
+    record_offsets = np.array(record_offsets, dtype=np.int64)
+
+    records = gather_records(buffer, record_offsets, POINT3D_RECORD_DTYPE)
+    lengths = records["track_length"].astype(np.int64)
+    track_offsets = np.zeros(num_points + 1, np.int64)
+    np.cumsum(lengths, out=track_offsets[1:])
+    elem_offsets = np.repeat(
+        record_offsets
+        + record_size
+        - TRACK_ELEM_DTYPE.itemsize * track_offsets[:-1],
+        lengths,
+    ) + TRACK_ELEM_DTYPE.itemsize * np.arange(track_offsets[-1])
+    track = gather_records(buffer, elem_offsets, TRACK_ELEM_DTYPE)
+    return PointCloudTable(
+        ids=records["id"].astype(np.int64),
+        xyz=records["xyz"].astype(np.float64),
+        rgb=records["rgb"].copy(),
+        error=records["error"].astype(np.float64),
+        track_offsets=track_offsets,
+        track_image_ids=track["image_id"].copy(),
+        track_point2D_idxs=track["point2D_idx"].copy(),
+    )
+
+
+def write_points3D_binary_table(table, path_to_model_file):
+    """
+    Same as write_points3D_binary, but for a PointCloudTable. The whole
+    file is assembled in memory and emitted with a single write.
+    """
+    num_points = table.num_points
+    lengths = table.track_lengths()
+    record_size = POINT3D_RECORD_DTYPE.itemsize
+    record_offsets = (
+        8
+        + record_size * np.arange(num_points, dtype=np.int64)
+        + TRACK_ELEM_DTYPE.itemsize * table.track_offsets[:-1]
+    )
+    records = np.empty(num_points, dtype=POINT3D_RECORD_DTYPE)
+    records["id"] = table.ids
+    records["xyz"] = table.xyz
+    records["rgb"] = table.rgb
+    records["error"] = table.error
+    records["track_length"] = lengths
+    track = np.empty(len(table.track_image_ids), dtype=TRACK_ELEM_DTYPE)
+    track["image_id"] = table.track_image_ids
+    track["point2D_idx"] = table.track_point2D_idxs
+    elem_offsets = np.repeat(
+        record_offsets
+        + record_size
+        - TRACK_ELEM_DTYPE.itemsize * table.track_offsets[:-1],
+        lengths,
+    ) + TRACK_ELEM_DTYPE.itemsize * np.arange(len(track))
+
+    buffer = np.empty(
+        8 + record_size * num_points + TRACK_ELEM_DTYPE.itemsize * len(track),
+        dtype=np.uint8,
+    )
+    buffer[:8] = np.array([num_points], dtype="<u8").view(np.uint8)
+    scatter_records(buffer, record_offsets, records)
+    scatter_records(buffer, elem_offsets, track)
+    with open(path_to_model_file, "wb") as fid:
+        fid.write(buffer)
+
+
 def write_points3D_text(points3D, path):
     """
     see: src/colmap/scene/reconstruction.cc
@@ -461,17 +786,9 @@ def write_points3D_binary(points3D, path_to_model_file):
         void Reconstruction::ReadPoints3DBinary(const std::string& path)
         void Reconstruction::WritePoints3DBinary(const std::string& path)
     """
-    with open(path_to_model_file, "wb") as fid:
-        write_next_bytes(fid, len(points3D), "Q")
-        for _, pt in points3D.items():
-            write_next_bytes(fid, pt.id, "Q")
-            write_next_bytes(fid, pt.xyz.tolist(), "ddd")
-            write_next_bytes(fid, pt.rgb.tolist(), "BBB")
-            write_next_bytes(fid, pt.error, "d")
-            track_length = pt.image_ids.shape[0]
-            write_next_bytes(fid, track_length, "Q")
-            for image_id, point2D_id in zip(pt.image_ids, pt.point2D_idxs):
-                write_next_bytes(fid, [image_id, point2D_id], "ii")
+    write_points3D_binary_table(
+        PointCloudTable.from_points3D(points3D), path_to_model_file
+    )
 
 
 def detect_model_format(path, ext):
@@ -486,7 +803,159 @@ def detect_model_format(path, ext):
     return False
 
 
-def read_model(path, ext=""):
+def file_hash(path, block_size=1 << 24):
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fid:
+        for block in iter(lambda: fid.read(block_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def model_files(path, ext):
+    return [
+        os.path.join(path, name + ext)
+        for name in ("cameras", "images", "points3D")
+    ]
+
+
+def read_model_cache(path, ext):
+    """Load the cached model of path, or return None if there is no cache
+    or it does not match the current cameras/images/points3D files.
+
+    A file matches when its size and mtime are unchanged, or when its size
+    is unchanged and its content hash still matches (e.g. after a copy).
+    """
+    cache_path = os.path.join(path, MODEL_CACHE_NAME)
+    if not os.path.isfile(cache_path):
+        return None
+    try:
+        cache = np.load(cache_path, allow_pickle=False)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable model cache {cache_path}: {e}")
+        return None
+    with cache:
+        if (
+            int(cache["version"]) != MODEL_CACHE_VERSION
+            or str(cache["ext"]) != ext
+        ):
+            return None
+        for idx, model_file in enumerate(model_files(path, ext)):
+            stat = os.stat(model_file)
+            if stat.st_size != cache["sizes"][idx]:
+                return None
+            if (
+                stat.st_mtime_ns != cache["mtimes"][idx]
+                and file_hash(model_file) != cache["hashes"][idx]
+            ):
+                return None
+
+        cameras = {}
+        params = np.split(
+            cache["camera_params"], cache["camera_params_offsets"][1:-1]
+        )
+        for idx, camera_id in enumerate(cache["camera_ids"].tolist()):
+            cameras[camera_id] = Camera(
+                id=camera_id,
+                model=str(cache["camera_models"][idx]),
+                width=int(cache["camera_widths"][idx]),
+                height=int(cache["camera_heights"][idx]),
+                params=params[idx],
+            )
+
+        images = {}
+        xys = cache["image_xys"]
+        point3D_ids = cache["image_point3D_ids"]
+        offsets = cache["image_points2D_offsets"].tolist()
+        for idx, image_id in enumerate(cache["image_ids"].tolist()):
+            start, end = offsets[idx], offsets[idx + 1]
+            images[image_id] = Image(
+                id=image_id,
+                qvec=cache["image_qvecs"][idx],
+                tvec=cache["image_tvecs"][idx],
+                camera_id=int(cache["image_camera_ids"][idx]),
+                name=str(cache["image_names"][idx]),
+                xys=xys[start:end],
+                point3D_ids=point3D_ids[start:end],
+            )
+
+        points3D = PointCloudTable(
+            *(cache["points3D_" + field] for field in PointCloudTable._fields)
+        )
+    return cameras, images, points3D
+
+
+def write_model_cache(path, ext, cameras, images, points3D):
+    """Store the model next to its files so read_model(..., use_cache=True)
+    can skip parsing them. points3D can be a dict or a PointCloudTable."""
+    if not isinstance(points3D, PointCloudTable):
+        points3D = PointCloudTable.from_points3D(points3D)
+    files = model_files(path, ext)
+    stats = [os.stat(model_file) for model_file in files]
+
+    cameras = list(cameras.values())
+    camera_params = [np.asarray(cam.params, np.float64) for cam in cameras]
+    camera_params_offsets = np.zeros(len(cameras) + 1, np.int64)
+    np.cumsum([len(p) for p in camera_params], out=camera_params_offsets[1:])
+
+    images = list(images.values())
+    image_points2D_offsets = np.zeros(len(images) + 1, np.int64)
+    np.cumsum(
+        [len(img.point3D_ids) for img in images],
+        out=image_points2D_offsets[1:],
+    )
+    arrays = dict(
+        version=MODEL_CACHE_VERSION,
+        ext=ext,
+        sizes=np.array([stat.st_size for stat in stats], np.int64),
+        mtimes=np.array([stat.st_mtime_ns for stat in stats], np.int64),
+        hashes=np.array([file_hash(model_file) for model_file in files]),
+        camera_ids=np.array([cam.id for cam in cameras], np.int64),
+        camera_models=np.array([cam.model for cam in cameras], dtype=str),
+        camera_widths=np.array([cam.width for cam in cameras], np.int64),
+        camera_heights=np.array([cam.height for cam in cameras], np.int64),
+        camera_params=np.concatenate(camera_params + [np.zeros(0)]),
+        camera_params_offsets=camera_params_offsets,
+        image_ids=np.array([img.id for img in images], np.int64),
+        image_qvecs=np.reshape([img.qvec for img in images], (-1, 4)),
+        image_tvecs=np.reshape([img.tvec for img in images], (-1, 3)),
+        image_camera_ids=np.array([img.camera_id for img in images], np.int64),
+        image_names=np.array([img.name for img in images], dtype=str),
+        image_points2D_offsets=image_points2D_offsets,
+        image_xys=np.concatenate(
+            [np.asarray(img.xys, np.float64).reshape(-1, 2) for img in images]
+            + [np.zeros((0, 2))]
+        ),
+        image_point3D_ids=np.concatenate(
+            [np.asarray(img.point3D_ids, np.int64) for img in images]
+            + [np.zeros(0, np.int64)]
+        ),
+    )
+    for field, array in zip(PointCloudTable._fields, points3D):
+        arrays["points3D_" + field] = array
+
+    # write to a temporary file first so readers never see a partial cache
+    cache_path = os.path.join(path, MODEL_CACHE_NAME)
+    tmp_path = cache_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as fid:
+            np.savez(fid, **arrays)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Could not write model cache {cache_path}: {e}")
+
+
+def read_model(path, ext="", points_as_table=False, use_cache=None):
+    """
+    :param points_as_table: Return points3D as a PointCloudTable instead of
+    a dict of Point3D.
+    :param use_cache: Load the model from MODEL_CACHE_NAME next to the model
+    files when it is up to date, and (re)build it otherwise. Defaults to the
+    COLMAP_MODEL_CACHE environment variable being set to 1, so every stage
+    of a pipeline can opt in at once.
+    """
+    if use_cache is None:
+        use_cache = os.environ.get("COLMAP_MODEL_CACHE", "0") == "1"
+
     # try to detect the extension automatically
     if ext == "":
         if detect_model_format(path, ".bin"):
@@ -497,26 +966,58 @@ def read_model(path, ext=""):
             print("Provide model format: '.bin' or '.txt'")
             return
 
+    if use_cache:
+        model = read_model_cache(path, ext)
+        if model is not None:
+            cameras, images, points3D = model
+            if not points_as_table:
+                points3D = points3D.to_points3D()
+            return cameras, images, points3D
+
     if ext == ".txt":
         cameras = read_cameras_text(os.path.join(path, "cameras" + ext))
         images = read_images_text(os.path.join(path, "images" + ext))
         points3D = read_points3D_text(os.path.join(path, "points3D") + ext)
+        if points_as_table or use_cache:
+            points3D = PointCloudTable.from_points3D(points3D)
     else:
         cameras = read_cameras_binary(os.path.join(path, "cameras" + ext))
         images = read_images_binary(os.path.join(path, "images" + ext))
-        points3D = read_points3D_binary(os.path.join(path, "points3D") + ext)
+        if points_as_table or use_cache:
+            points3D = read_points3D_binary_table(
+                os.path.join(path, "points3D") + ext
+            )
+        else:
+            points3D = read_points3D_binary(
+                os.path.join(path, "points3D") + ext
+            )
+
+    if use_cache:
+        write_model_cache(path, ext, cameras, images, points3D)
+        if not points_as_table:
+            points3D = points3D.to_points3D()
     return cameras, images, points3D
 
 
 def write_model(cameras, images, points3D, path, ext=".bin"):
+    """points3D can be either a dict of Point3D or a PointCloudTable."""
     if ext == ".txt":
+        if isinstance(points3D, PointCloudTable):
+            points3D = points3D.to_points3D()
         write_cameras_text(cameras, os.path.join(path, "cameras" + ext))
         write_images_text(images, os.path.join(path, "images" + ext))
         write_points3D_text(points3D, os.path.join(path, "points3D") + ext)
     else:
         write_cameras_binary(cameras, os.path.join(path, "cameras" + ext))
         write_images_binary(images, os.path.join(path, "images" + ext))
-        write_points3D_binary(points3D, os.path.join(path, "points3D") + ext)
+        if isinstance(points3D, PointCloudTable):
+            write_points3D_binary_table(
+                points3D, os.path.join(path, "points3D") + ext
+            )
+        else:
+            write_points3D_binary(
+                points3D, os.path.join(path, "points3D") + ext
+            )
     return cameras, images, points3D
 
 
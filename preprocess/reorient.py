@@ -9,44 +9,12 @@
 # For inquiries contact  george.drettakis@inria.fr
 #
 
-import numpy as np
 import torch
 import argparse
 import ast
 import os, time
 from read_write_model import *
-
-def rotate_camera(qvec, tvec, rot_matrix, upscale):
-    # Assuming cameras have 'T' (translation) field
-
-    R = qvec2rotmat(qvec)
-    T = np.array(tvec)
-
-    Rt = np.zeros((4, 4))
-    Rt[:3, :3] = R
-    Rt[:3, 3] = T
-    Rt[3, 3] = 1.0
-
-    C2W = np.linalg.inv(Rt)
-    cam_center = np.copy(C2W[:3, 3])
-    cam_rot_orig = np.copy(C2W[:3, :3])
-    cam_center = np.matmul(cam_center, rot_matrix)
-    cam_rot = np.linalg.inv(rot_matrix) @ cam_rot_orig
-    C2W[:3, 3] = upscale * cam_center
-    C2W[:3, :3] = cam_rot
-    Rt = np.linalg.inv(C2W)
-    new_pos = Rt[:3, 3]
-    new_rot = rotmat2qvec(Rt[:3, :3])
-
-    # R_test = qvec2rotmat(new_rots[-1])
-    # T_test = np.array(new_poss[-1])
-    # Rttest = np.zeros((4, 4))
-    # Rttest[:3, :3] = R_test
-    # Rttest[:3, 3] = T_test
-    # Rttest[3, 3] = 1.0
-    # C2Wtest = np.linalg.inv(Rttest) 
-
-    return new_pos, new_rot
+from pose_utils import image_poses, transform_poses
 
 # Function to compute the cross product of two 3D vectors
 def cross_product(v1, v2):
@@ -128,38 +96,23 @@ def main():
 
     # Read colmap cameras, images and points
     start_time = time.time()
-    cameras, images_metas_in, points3d_in = read_model(args.input_path, ext=f".{ext}")
+    cameras, images_metas_in, points3d_in = read_model(args.input_path, ext=f".{ext}", points_as_table=True)
     end_time = time.time()
     print(f"{len(images_metas_in)} images read in {end_time - start_time} seconds.")
 
-    positions = []
+    rotation_matrix = rotation_matrix.double().numpy()
+
     print("Doing points")
-    for key in points3d_in: 
-        positions.append(points3d_in[key].xyz)
-    
-    positions = torch.from_numpy(np.array(positions))
-    
     # Perform the rotation by matrix multiplication
-    rotated_points = args.upscale * torch.matmul(positions, rotation_matrix)
-
-    points3d_out = {}
-    for key, rotated in zip(points3d_in, rotated_points):
-        point3d_in = points3d_in[key]
-        points3d_out[key] = Point3D(
-            id=point3d_in.id,
-            xyz=rotated,
-            rgb=point3d_in.rgb,
-            error=point3d_in.error,
-            image_ids=point3d_in.image_ids,
-            point2D_idxs=point3d_in.point2D_idxs,
-        )
+    rotated_points = args.upscale * (points3d_in.xyz @ rotation_matrix)
+    points3d_out = points3d_in._replace(xyz=rotated_points)
 
     print("Doing images")
+    # points are transformed by x' = upscale * rotation_matrix.T @ x
+    new_rots, new_poss = transform_poses(*image_poses(images_metas_in), args.upscale, rotation_matrix.T)
     images_metas_out = {} 
-    for key in images_metas_in: 
+    for key, new_rot, new_pos in zip(images_metas_in, new_rots, new_poss): 
         image_meta_in = images_metas_in[key]
-        new_pos, new_rot = rotate_camera(image_meta_in.qvec, image_meta_in.tvec, rotation_matrix.double().numpy(), args.upscale)
-        
         images_metas_out[key] = Image(
             id=image_meta_in.id,
             qvec=new_rot,
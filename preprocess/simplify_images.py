@@ -11,7 +11,8 @@
 
 import os, argparse
 import numpy as np
-from read_write_model import Image, read_images_binary, read_images_text, write_images_binary, write_images_text, qvec2rotmat
+from read_write_model import Image, read_images_binary, read_images_text, write_images_binary, write_images_text
+from pose_utils import image_poses, camera_centers
 from sklearn.neighbors import NearestNeighbors
 
 if __name__ == '__main__':
@@ -34,10 +35,7 @@ if __name__ == '__main__':
         images_metas = read_images_binary(images_file)
 
 
-    cam_centers = np.array([
-        -qvec2rotmat(images_metas[key].qvec).T @ images_metas[key].tvec 
-        for key in images_metas
-    ])
+    cam_centers = camera_centers(*image_poses(images_metas))
     cam_nbrs = NearestNeighbors(n_neighbors=2).fit(cam_centers)
     centers_std = cam_centers.std(axis=0).mean()
     
@@ -75,6 +73,10 @@ if __name__ == '__main__':
 
     print(f"{len(images_metas)} images before; {len(filtered_images)} images after")
 
+    # release the memory-mapped images file before renaming it: the kept
+    # observations are copies, but the loop variable still views the mapping
+    images_metas = image_meta = None
+
     # rename old images.bin/txt as images_heavy
     if os.path.exists(f"images_heavy.{ext}"):
         os.remove(f"images_heavy.{ext}")
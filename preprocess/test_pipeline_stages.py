@@ -0,0 +1,74 @@
+import os, sys
+import time
+import tempfile
+import unittest
+# the preprocess scripts import each other as top-level modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from pipeline_stages import StageRunner, EXIF_GPS_INDEX_NAME
+
+class StageRunnerTest(unittest.TestCase):
+    """Stages that read a folder a later stage writes caches into."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        self.images_dir = os.path.join(self.root, "images")
+        os.makedirs(self.images_dir)
+        for name in ["0.jpg", "1.jpg"]:
+            open(os.path.join(self.images_dir, name), "w").close()
+        self.runs = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, path, content):
+        with open(path, "w") as f:
+            f.write(content)
+
+    def run_pipeline(self, rerun_from=None):
+        stages = StageRunner(os.path.join(self.root, "stages"), rerun_from)
+        database_path = os.path.join(self.root, "database.db")
+        matching_path = os.path.join(self.root, "matching.txt")
+
+        def extract():
+            self.runs.append("extract")
+            self.write(database_path, "features")
+
+        def match():
+            # caches written into the image folder, as the EXIF GPS index could be
+            self.runs.append("match")
+            self.write(os.path.join(self.images_dir, EXIF_GPS_INDEX_NAME), str(time.time()))
+            self.write(os.path.join(self.images_dir, EXIF_GPS_INDEX_NAME + ".tmp"), "")
+            self.write(matching_path, "0.jpg 1.jpg")
+
+        def import_matches():
+            self.runs.append("import")
+            self.write(database_path, "features matches")
+
+        stages.run("extract", extract, params=[], inputs=[self.images_dir], outputs=[database_path])
+        stages.run("match", match, params=[], inputs=[self.images_dir], outputs=[matching_path])
+        stages.run("import", import_matches, params=[], inputs=[database_path, matching_path], outputs=[database_path])
+
+    def test_resume_skips_up_to_date_stages(self):
+        self.run_pipeline()
+        self.assertEqual(self.runs, ["extract", "match", "import"])
+        self.runs = []
+        self.run_pipeline()
+        self.assertEqual(self.runs, [])
+
+    def test_new_input_reruns_downstream_stages(self):
+        self.run_pipeline()
+        self.runs = []
+        time.sleep(0.01)
+        open(os.path.join(self.images_dir, "2.jpg"), "w").close()
+        self.run_pipeline()
+        self.assertEqual(self.runs, ["extract", "match", "import"])
+
+    def test_rerun_from(self):
+        self.run_pipeline()
+        self.runs = []
+        self.run_pipeline(rerun_from="match")
+        self.assertEqual(self.runs, ["match", "import"])
+
+if __name__ == '__main__':
+    unittest.main()
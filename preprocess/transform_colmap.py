@@ -16,6 +16,7 @@ import shutil
 import random
 import torch
 from read_write_model import *
+from pose_utils import image_poses, camera_centers, qvecs2rotmats, rotmats2qvecs
 
 Transform = collections.namedtuple(
     "Transform", ["t0", "t1", "s0", "s1", "R"]
@@ -43,15 +44,6 @@ def procrustes_analysis(X0,X1): # [N,3]
     sim3 = Transform(t0=t0[0],t1=t1[0],s0=s0,s1=s1,R=R)
     return sim3
 
-def get_nb_pts(image_metas):
-    n_pts = 0
-    for key in image_metas:
-        pts_idx = image_metas[key].point3D_ids
-        if(len(pts_idx) > 5):
-            n_pts = max(n_pts, np.max(pts_idx))
-
-    return n_pts + 1
-
 if __name__ == '__main__':
     random.seed(0)
     parser = argparse.ArgumentParser()
@@ -60,22 +52,16 @@ if __name__ == '__main__':
     parser.add_argument('--out_dir', required=True)
     args = parser.parse_args()
 
-    old_images_metas = read_images_binary(f"{args.in_dir}/sparse/0/images.bin")
+    old_images_metas = read_images_binary(f"{args.in_dir}/sparse/0/images.bin", fields=("qvec", "tvec", "name"))
     new_images_metas = read_images_binary(f"{args.new_colmap_dir}/sparse/0/images.bin")
-    n_pts = get_nb_pts(new_images_metas)
     
     old_keys = old_images_metas.keys()
     old_keys_dict = {old_images_metas[key].name: key for key in old_keys}
     new_old_key_mapping = {key: old_keys_dict[new_images_metas[key].name] for key in new_images_metas}
 
-    old_cam_centers = np.array([
-        -qvec2rotmat(old_images_metas[new_old_key_mapping[key]].qvec).astype(np.float32).T @ old_images_metas[new_old_key_mapping[key]].tvec.astype(np.float32) 
-        for key in new_images_metas
-    ])
-    new_cam_centers = np.array([
-        -qvec2rotmat(new_images_metas[key].qvec).astype(np.float32).T @ new_images_metas[key].tvec.astype(np.float32) 
-        for key in new_images_metas
-    ])
+    old_cam_centers = camera_centers(*image_poses({key: old_images_metas[new_old_key_mapping[key]] for key in new_images_metas}), dtype=np.float32)
+    new_qvecs, new_tvecs = image_poses(new_images_metas)
+    new_cam_centers = camera_centers(new_qvecs, new_tvecs, dtype=np.float32)
 
     dists = np.linalg.norm(old_cam_centers - new_cam_centers, axis=-1)
     valid_cams = dists <= (np.median(dists) * 5) + 1e-8
@@ -90,22 +76,13 @@ if __name__ == '__main__':
 
     sim3 = procrustes_analysis(old_cam_centers_torch_trimmed, new_cam_centers_torch_trimmed)
     center_aligned = (new_cam_centers_torch-sim3.t1)/sim3.s1@sim3.R.t()*sim3.s0+sim3.t0
-    points3d = read_points3D_binary(f"{args.new_colmap_dir}/sparse/0/points3D.bin")
-
-    xyzs = np.zeros([n_pts, 3], np.float32)
-    errors = np.zeros([n_pts], np.float32) + 9e9
-    indices = np.zeros([n_pts], np.int64)
-    n_images = np.zeros([n_pts], np.int64)
-    colors = np.zeros([n_pts, 3], np.float32)
-
-    idx = 0    
-    for key in points3d:
-        xyzs[idx] = points3d[key].xyz
-        indices[idx] = points3d[key].id
-        errors[idx] = points3d[key].error
-        colors[idx] = points3d[key].rgb
-        n_images[idx] = len(points3d[key].image_ids)
-        idx +=1
+    points3d = read_points3D_binary_table(f"{args.new_colmap_dir}/sparse/0/points3D.bin")
+
+    xyzs = points3d.xyz.astype(np.float32)
+    errors = points3d.error.astype(np.float32)
+    indices = points3d.ids
+    n_images = points3d.track_lengths()
+    colors = points3d.rgb.astype(np.float32)
 
     mask = errors < 1.5
     mask *= n_images > 3
@@ -114,38 +91,24 @@ if __name__ == '__main__':
 
     points3dC_aligned = ((torch.from_numpy(xyzsC)-sim3.t1)/sim3.s1@sim3.R.t()*sim3.s0+sim3.t0).numpy()
     
-    R = torch.from_numpy(np.array([
-        qvec2rotmat(new_images_metas[key].qvec).astype(np.float32)
-        for key in new_images_metas
-    ]))
+    R = torch.from_numpy(qvecs2rotmats(new_qvecs).astype(np.float32))
     R_aligned = R@sim3.R.t()
     t_aligned = (-R_aligned@center_aligned[...,None])[...,0]
-
-    with open(f"{args.in_dir}/center.txt", 'r') as f:
-        center = np.array(tuple(map(float, f.readline().strip().split())))
-    with open(f"{args.in_dir}/extent.txt", 'r') as f:
-        extent = np.array(tuple(map(float, f.readline().strip().split())))
-
-    corner_min = center - 1.1 * extent / 2
-    corner_max = center + 1.1 * extent / 2
+    qvecs_aligned = rotmats2qvecs(R_aligned.numpy())
 
     out_colmap = f"{args.out_dir}/sparse/0"
     os.makedirs(out_colmap, exist_ok=True)
     
-    mask = np.all(points3dC_aligned < corner_max, axis=-1) * np.all(points3dC_aligned > corner_min, axis=-1)
-    new_points3d = points3dC_aligned#[mask]
     new_colors = np.clip(colorsC, 0, 255).astype(np.uint8)
-    new_indices = indicesC#[mask]
-    new_errors = errorsC#[mask]
 
     images_metas_out = {}
-    for key, R, t, valid_cam in zip(new_images_metas, R_aligned.numpy(), t_aligned.numpy(), valid_cams):
+    for key, qvec, t, valid_cam in zip(new_images_metas, qvecs_aligned, t_aligned.numpy(), valid_cams):
         if valid_cam:
             image_meta = new_images_metas[key]
 
             images_metas_out[key] = Image(
                 id = key,
-                qvec = rotmat2qvec(R),
+                qvec = qvec,
                 tvec = t,
                 camera_id = image_meta.camera_id,
                 name = image_meta.name,
@@ -155,19 +118,9 @@ if __name__ == '__main__':
 
     write_images_binary(images_metas_out, f"{out_colmap}/images.bin")
 
-    points_out = {
-        new_indices[idx] : Point3D(
-                id=indicesC[idx],
-                xyz= points3dC_aligned[idx],
-                rgb=new_colors[idx],
-                error=errorsC[idx],
-                image_ids=np.array([]),
-                point2D_idxs=np.array([])
-            )
-        for idx in range(len(points3dC_aligned))
-    }
+    points_out = PointCloudTable.from_arrays(indicesC, points3dC_aligned, new_colors, errorsC)
 
-    write_points3D_binary(points_out, f"{out_colmap}/points3D.bin")    
+    write_points3D_binary_table(points_out, f"{out_colmap}/points3D.bin")    
 
     shutil.copy(f"{args.new_colmap_dir}/sparse/0/cameras.bin", f"{out_colmap}/cameras.bin")
     shutil.copy(f"{args.in_dir}/center.txt", f"{args.out_dir}/center.txt")